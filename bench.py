@@ -0,0 +1,181 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+
+from joblib import load
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime as date, timedelta
+
+import train
+import forest
+import dataset
+import process
+import retrieve
+import localsheet
+
+# Time a function, returning its result and the seconds it took
+def timed(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return result, time.perf_counter() - start
+
+# Get the commit the benchmark is run on, so results can be compared across commits
+def get_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+# Get the peak memory of this process in MB, if the platform can tell
+def get_peak_memory():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports kilobytes
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+# Train a nation's model, returning its accuracy, the seconds it took and how much it grew the peak memory
+def train_measured(nation, data_prefix, model_prefix, n_jobs, mode):
+    # Import sklearn first, so importing it is not counted as training
+    import sklearn.ensemble, sklearn.multioutput, sklearn.model_selection, sklearn.metrics
+    before = get_peak_memory()
+    accuracy, seconds = timed(train.train_mining_model, nation, data_prefix, model_prefix, n_jobs, mode)
+    after = get_peak_memory()
+    return accuracy, seconds, None if before is None else after - before
+
+# Train a nation's model in one mode and time loading it and predicting with it
+def measure_model(nation, data_prefix, model_prefix, n_jobs, mode, single_repeat, batch_rows):
+    os.makedirs(model_prefix, exist_ok=True)
+    # Training in a fresh process, so its peak memory is not hidden by earlier nations
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        accuracy, seconds, peak = pool.submit(train_measured, nation, data_prefix, model_prefix, n_jobs, mode).result()
+    path = train.model_file(model_prefix, nation)
+    
+    # Loading the model
+    classifier, load_s = timed(load, path)
+    
+    # Predicting one row at a time, and many rows at once
+    features = np.asarray(dataset.MiningDataset(data_prefix, nation).features())
+    single = []
+    for j in range(single_repeat):
+        single.append(timed(train.predict_classifier, classifier, features[j % len(features)])[1])
+    batch = features[np.arange(batch_rows) % len(features)]
+    _, batch_s = timed(train.predict_classifier, classifier, batch)
+    
+    # The same with the compiled model, which does not need sklearn
+    compiled, compiled_load_s = timed(forest.CompiledForest.load, forest.forest_dir(model_prefix, nation, forest.get_source(path)))
+    compiled_single = []
+    for j in range(single_repeat):
+        compiled_single.append(timed(compiled.predict, features[j % len(features)])[1])
+    _, compiled_batch_s = timed(compiled.predict, batch)
+    
+    return {
+        "train_s" : seconds,
+        "train_peak_mb" : peak,
+        "accuracy" : accuracy,
+        "model_mb" : os.path.getsize(path) / 2 ** 20,
+        "load_s" : load_s,
+        "predict_single_ms" : float(np.median(single)) * 1000,
+        "predict_batch_s" : batch_s,
+        "predict_batch_rows" : batch_rows,
+        "compiled_load_s" : compiled_load_s,
+        "compiled_predict_single_ms" : float(np.median(compiled_single)) * 1000,
+        "compiled_predict_batch_s" : compiled_batch_s
+    }
+
+# Print the accuracy, size and speed of every mode of a nation side by side
+def print_modes(name, modes):
+    print(f"Bench: { name }")
+    print(f"Bench:   { 'mode':10} { 'accuracy':>9} { 'size MB':>9} { 'load ms':>9} { 'single ms':>10} { 'batch ms':>9} | compiled { 'load ms':>9} { 'single ms':>10} { 'batch ms':>9}")
+    for mode, m in modes.items():
+        print(f"Bench:   { mode:10} { m['accuracy']:9.4f} { m['model_mb']:9.2f} { m['load_s'] * 1000:9.1f} { m['predict_single_ms']:10.2f} { m['predict_batch_s'] * 1000:9.1f} | "
+              f"{ '':8} { m['compiled_load_s'] * 1000:9.1f} { m['compiled_predict_single_ms']:10.2f} { m['compiled_predict_batch_s'] * 1000:9.1f}", flush=True)
+
+# Generate the raw cell values of a "<Nation> Data" sheet with the given amount of rows
+def generate_rows(rows, seed, ores = 12, shown = 3, hidden = 2, leylines = 6):
+    rng = np.random.default_rng(seed)
+    start = date.today() - timedelta(days=rows - 1)
+    dates = [(start + timedelta(days=d)).strftime("%m/%d/%y") for d in range(rows)]
+    cells = [localsheet.LocalSpreadsheet.random_row(rng, ores, shown, hidden, leylines) for _ in range(rows)]
+    return dates, [c[0] for c in cells], [c[1] for c in cells]
+
+# Benchmark every stage for one size of dataset
+def run_size(rows, nations, prefix, n_jobs, modes, single_repeat, batch_rows):
+    result = { "rows" : rows, "nations" : len(nations), "parse_s" : 0, "build_s" : 0, "train" : {} }
+    for i, n in enumerate(nations):
+        dates, ores, leylines = generate_rows(rows, i)
+        
+        # Parsing the cell values
+        parsed, seconds = timed(retrieve.parse_rows, dates, ores, leylines)
+        result["parse_s"] += seconds
+        
+        # Building the dataset
+        data = dataset.MiningDataset(prefix, n)
+        data.reset()
+        _, seconds = timed(data.append, parsed["d"], parsed["ores"], parsed["y"], parsed["b"], rows + 2, dates[-1])
+        result["build_s"] += seconds
+        
+        # Training, loading and predicting with every mode
+        result["train"][n] = { m : measure_model(n, prefix, prefix + m + os.sep, n_jobs, m, single_repeat, batch_rows) for m in modes }
+        print_modes(f"[{ rows } rows] [{ n }]", result["train"][n])
+    
+    result["train_s"] = { m : sum(t[m]["train_s"] for t in result["train"].values()) for m in modes }
+    return result
+
+# Compare the modes on the stored data of each nation, to pick the mode of each one
+def compare_stored(nations, data_prefix, prefix, n_jobs, modes, single_repeat, batch_rows):
+    result = { "nations" : {} }
+    for n in nations:
+        if dataset.MiningDataset(data_prefix, n).rows == 0:
+            print(f"Bench: [{ n }] No stored data, skipping...")
+            continue
+        result["nations"][n] = { m : measure_model(n, data_prefix, prefix + m + os.sep, n_jobs, m, single_repeat, batch_rows) for m in modes }
+        print_modes(f"[{ n }]", result["nations"][n])
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(prog="Leyline Classifier Benchmark", description="Times retrieval parsing, dataset building, training and prediction on synthetic data")
+    parser.add_argument('-s', '--sizes', dest="sizes", default="100,1000,10000,100000", help="comma separated rows per nation to benchmark", type=str)
+    parser.add_argument('-n', '--nations', dest="nations", default=7, help="how many nations to benchmark", type=int)
+    parser.add_argument('-j', '--jobs', dest="jobs", default=1, help="cores used to train each forest", type=int)
+    parser.add_argument('-r', '--repeat', dest="repeat", default=100, help="how many single predictions to time", type=int)
+    parser.add_argument('-b', '--batch', dest="batch", default=1000, help="how many rows to predict in the batch", type=int)
+    parser.add_argument('-m', '--modes', dest="modes", default=",".join(process.mode_params), help="comma separated model modes to compare", type=str)
+    parser.add_argument('-c', '--compare', dest="compare", action="store_const", default=False, const=True, help="whether to compare the modes on the stored data instead of synthetic data")
+    parser.add_argument('-o', '--output', dest="output", default="bench_results.json", help="what file the results are written to", type=str)
+    arg = parser.parse_args()
+    
+    with open("config.json") as config:
+        settings = json.load(config)
+    nations = settings["nations"][:arg.nations]
+    modes = arg.modes.split(",")
+    
+    import sklearn
+    results = {
+        "commit" : get_commit(),
+        "date" : date.now().isoformat(),
+        "python" : platform.python_version(),
+        "numpy" : np.__version__,
+        "sklearn" : sklearn.__version__,
+        "modes" : { m : process.mode_params[m] for m in modes }
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        if arg.compare:
+            results["stored"] = compare_stored(nations, settings["data_prefix"], directory + os.sep, arg.jobs, modes, arg.repeat, arg.batch)
+        else:
+            results["sizes"] = [run_size(int(rows), nations, directory + os.sep, arg.jobs, modes, arg.repeat, arg.batch) for rows in arg.sizes.split(",")]
+    
+    with open(arg.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Bench: Results written to { arg.output }")
+
+if __name__ == "__main__":
+    sys.exit(main())
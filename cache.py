@@ -0,0 +1,78 @@
+import os
+import json
+import threading
+import numpy as np
+import logging as log
+
+from os.path import isfile
+from collections import OrderedDict
+
+# Predictions of the mining models, keyed by nation, model version and feature vector, so repeated polls skip the forests
+# The least recently used predictions are dropped past the size, and they are kept in a file between runs if one is given
+class PredictionCache():
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.size = cfg.prediction_cache["size"]
+        self.path = cfg.prediction_cache["file"]
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.changed = False
+        self.read()
+
+    # Get the key of a prediction, the features are stored as a JSON list so they compare exactly
+    @staticmethod
+    def get_key(nation, version, features) -> str:
+        return nation + "|" + version + "|" + json.dumps(np.asarray(features).tolist())
+
+    # Read the predictions stored by an earlier run, starting empty if the file is missing or unreadable
+    def read(self):
+        if not self.path or not isfile(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except ValueError:
+            self.cfg.write_log(f"Cache: Could not read \"{ self.path }\", starting empty...", log.warning, True)
+            return
+        for key, labels, confidence in entries[-self.size:]:
+            self.entries[key] = (labels, confidence)
+
+    # Write the predictions to the file, if any changed
+    def save(self):
+        with self.lock:
+            if not self.path or not self.changed:
+                return
+            entries = [[key, labels, confidence] for key, (labels, confidence) in self.entries.items()]
+            # Replace the file in one step, so an interrupted write never loses the old predictions
+            with open(self.path + ".tmp", 'w') as f:
+                json.dump(entries, f)
+            os.replace(self.path + ".tmp", self.path)
+            self.changed = False
+
+    # Get the labels and confidence of a prediction, or None if it is not stored
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            labels, confidence = self.entries[key]
+        return np.array(labels), np.array(confidence)
+
+    # Store the labels and confidence of a prediction, dropping the least recently used past the size
+    def put(self, key, labels, confidence):
+        with self.lock:
+            self.entries[key] = (np.asarray(labels).tolist(), np.asarray(confidence).tolist())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+            self.changed = True
+
+    # Drop the predictions of a nation made by any other model version
+    def invalidate(self, nation, version):
+        prefix = nation + "|"
+        with self.lock:
+            outdated = [k for k in self.entries if k.startswith(prefix) and not k.startswith(prefix + version + "|")]
+            for k in outdated:
+                del self.entries[k]
+            self.changed = self.changed or bool(outdated)
+        return len(outdated)
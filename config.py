@@ -1,9 +1,11 @@
-import json
 import gspread
 import argparse
 import logging as log
+
+import sheets
+import metadata
+import localsheet
 from os.path import isfile
-from datetime import datetime as date
 
 class cfg:
     suffix_names = {
@@ -14,16 +16,18 @@ class cfg:
         'b' : "blabel"
         }
     
-    def __init__(self):
-        self.parse_arguments()
+    # Arguments are parsed from the command line if not given, and tools that do not use the sheet can skip connecting to it
+    def __init__(self, args = None, connect = True):
+        self.parse_arguments(args)
         self.read()
-        self.connect_to_sheets()
+        if connect:
+            self.connect_to_sheets()
     
     def write_log(self, message, func, important = False):
         if important or self.arg.verbose:
             func(message)
     
-    def parse_arguments(self):
+    def parse_arguments(self, args = None):
         parser = argparse.ArgumentParser(prog="Leyline Classifier",
                                     description="Classifies Leylines and Mining Outcrops with the use of AI")
         parser.add_argument('-v', '--verbose', dest="verbose", action="store_const", default=False, const=True, help="whether console output should be verbose")
@@ -35,55 +39,90 @@ class cfg:
         parser.add_argument('-a', '--autofill', action="store_const", default=False, const=True, help="whether the program should run the autofill command at startup")
         parser.add_argument('-e', '--errorcheck', action="store_const", default=False, const=True, help="whether the program should test the data for errors")
         parser.add_argument('-s', '--singlethread', action="store_const", default=False, const=True, help="whether the program should be single threaded")
-        self.arg = parser.parse_args()
+        parser.add_argument('-i', '--interval', dest="interval", default=0, help="minutes between headless autofill runs, 0 to run once", type=float)
+        parser.add_argument('-w', '--watch', action="store_const", default=False, const=True, help="whether headless should watch DataEntry and fill in nations as they change")
+        self.arg = parser.parse_args(args)
         log.basicConfig(format="%(message)s", level=self.arg.output.upper() if not self.arg.verbose else "INFO", filename=self.arg.file)
     
     def connect_to_sheets(self):
+        self.sheets = sheets.SheetsClient(self)
+        if self.sheet_backend == "local":
+            self.connect_to_local_sheets()
+            return
         if not isfile("key.json"):
             self.write_log("Input: File \"key.json\" does not exist. Please create the file with your Google Sheets credentials.", log.error, True)
             exit(1)
         # Authenticate Google Sheets API
         self.client = gspread.service_account("key.json")
         try:
-            self.ws = self.client.open_by_key(self.sheet_id)
-            self.sheet = self.ws.worksheet("DataEntry")
+            self.ws = self.sheets.call(lambda: self.client.open_by_key(self.sheet_id), "open")
+            self.sheet = self.sheets.call(lambda: self.ws.worksheet("DataEntry"), "worksheet")
         except:
             self.write_log("Input: The sheet ID in the config is not valid with your account.", log.error, True)
             exit(1)
     
+    # Use a local stand-in for the spreadsheet, for offline runs and load testing
+    def connect_to_local_sheets(self):
+        if not isfile(self.local_sheet["file"]):
+            self.write_log(f"Input: Local sheet \"{ self.local_sheet['file'] }\" does not exist. Create it with localsheet.py.", log.error, True)
+            exit(1)
+        self.write_log(f"Input: Using local sheet \"{ self.local_sheet['file'] }\"...", log.warning, True)
+        self.client = None
+        self.ws = localsheet.LocalSpreadsheet.open(self.local_sheet["file"], self.local_sheet["latency"], self.local_sheet["error_rate"])
+        self.sheet = self.sheets.call(lambda: self.ws.worksheet("DataEntry"), "worksheet")
+    
     def read(self):
         self.write_log("Config: Reading normal config...", log.info)
-        with open("config.json") as config:
-            self.data = json.load(config)
-            self.force_data_reset = self.data["force_data_reset"] or self.arg.reset
-            self.force_model_reset = self.data["force_model_reset"] or self.arg.reset or self.arg.model
-            self.suffix = { n : self.data[v + "_suffix"] for n, v in cfg.suffix_names.items() }
-            self.data_prefix = self.data["data_prefix"]
-            self.model_prefix = self.data["model_prefix"]
-            self.data_days = self.data["min_data_days"]
-            self.sheet_id = self.data["sheet"]
-            self.nations = self.data["nations"]
+        self.settings = metadata.MetadataStore("config.json")
+        self.data = self.settings.data
+        self.settings.delay = self.data["metadata_flush_delay"]
+        self.force_data_reset = self.data["force_data_reset"] or self.arg.reset
+        self.force_model_reset = self.data["force_model_reset"] or self.arg.reset or self.arg.model
+        self.suffix = { n : self.data[v + "_suffix"] for n, v in cfg.suffix_names.items() }
+        self.data_prefix = self.data["data_prefix"]
+        self.model_prefix = self.data["model_prefix"]
+        self.data_days = self.data["min_data_days"]
+        self.sheet_id = self.data["sheet"]
+        self.sheet_backend = self.data["sheet_backend"]
+        self.local_sheet = self.data["local_sheet"]
+        self.nations = self.data["nations"]
+        self.cpu_budget = self.data["cpu_budget"]
+        self.model_modes = self.data["model_modes"]
+        self.incremental_training = self.data["incremental_training"]
+        self.worker_threads = self.data["worker_threads"]
+        self.metrics_file = self.data["metrics_file"]
+        self.service = self.data["service"]
+        self.watch_interval = self.data["watch_interval"]
+        self.prediction_cache = self.data["prediction_cache"]
+        self.sheets_quota = self.data["sheets_requests_per_minute"]
+        self.sheets_max_retries = self.data["sheets_max_retries"]
+        self.sheets_backoff_base = self.data["sheets_backoff_base"]
+        self.sheets_backoff_max = self.data["sheets_backoff_max"]
+        self.sheets_concurrency = self.data["sheets_concurrency"]
         self.write_log("Config: Reading model config...", log.info)
-        try:
-            with open(self.model_prefix + "config.json") as config:
-                self.model_data = json.load(config)
-        except FileNotFoundError:
-            self.write_log("Config: Initializing model config file...", log.warning, True)
-            with open(self.model_prefix + "config.json", "w") as d:
-                self.model_data = {"Data" : date(0,0,0).timestamp}
-                json.dump(self.model_data, d)
+        # A missing model config starts out with data that is due for an update
+        self.models = metadata.MetadataStore(self.model_prefix + "config.json", self.data["metadata_flush_delay"], { "Data" : 0 })
+        if self.models.created:
+            self.write_log("Config: Initialized model config file.", log.warning, True)
+        self.model_data = self.models.data
         self.timestamp = self.model_data["Data"]
         self.accuracy = {}
         self.accuracy["mining"] = { n : self.model_data[n + "_mining_accuracy"] if n + "_mining_accuracy" in self.model_data else 0 for n in self.nations }
     
     def write(self, index, value):
         self.write_log(f"Config: Writing value { value } to { index } in normal config...", log.debug)
-        self.data[index] = value
-        with open("config.json", 'w') as config:
-            json.dump(self.data, config, indent=2)
+        self.settings.set(index, value)
     
     def write_model(self, index, value):
         self.write_log(f"Config: Writing value { value } to { index } in model config...", log.debug)
-        self.model_data[index] = value
-        with open(self.model_prefix + "config.json", 'w') as config:
-            json.dump(self.model_data, config, indent=2)
\ No newline at end of file
+        self.models.set(index, value)
+    
+    # Write several values to the model config together
+    def write_models(self, values: dict):
+        self.write_log(f"Config: Writing { ', '.join(values) } in model config...", log.debug)
+        self.models.update(values)
+    
+    # Write every pending change to the config files now
+    def flush(self):
+        self.settings.flush()
+        self.models.flush()
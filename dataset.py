@@ -0,0 +1,183 @@
+import os
+import json
+import uuid
+import hashlib
+import numpy as np
+
+from os.path import isfile
+
+# A nation's mining data, stored as one fixed-width integer matrix that can be memory-mapped and appended to
+# Each row holds [year, month, day, shown ores..., y, b, hidden ores..., shown mask..., hidden mask...]
+# so the model features and labels are contiguous column ranges
+class MiningDataset():
+    version = 1
+    dtype = np.dtype(np.int16)
+    
+    def __init__(self, data_prefix, nation):
+        self.nation = nation
+        self.data_file = data_prefix + nation.lower() + "_mining.bin"
+        self.meta_file = data_prefix + nation.lower() + "_mining.json"
+        self.read()
+    
+    # Read the metadata of the store, starting over if it is missing or outdated
+    def read(self):
+        self.meta = None
+        if isfile(self.meta_file) and isfile(self.data_file):
+            with open(self.meta_file) as f:
+                meta = json.load(f)
+            if meta["version"] == MiningDataset.version and os.path.getsize(self.data_file) == meta["rows"] * MiningDataset.get_width(meta) * MiningDataset.dtype.itemsize:
+                self.meta = meta
+        if self.meta is None:
+            self.meta = MiningDataset.empty_meta()
+    
+    # Metadata of a store without any rows
+    @staticmethod
+    def empty_meta() -> dict:
+        return {
+            "version" : MiningDataset.version,
+            "generation" : uuid.uuid4().hex,
+            "rows" : 0,
+            "ores" : 0,
+            "shown" : 0,
+            "hidden" : 0,
+            "leylines" : 0,
+            "last_row" : 0,
+            "last_date" : "",
+            "hash" : ""
+        }
+    
+    # Get the amount of columns of a store layout
+    @staticmethod
+    def get_width(meta) -> int:
+        return 5 + meta["shown"] + meta["hidden"] + 2 * meta["ores"]
+    
+    # Get the column ranges of a store layout
+    @staticmethod
+    def get_columns(meta) -> dict:
+        shown, hidden, ores = meta["shown"], meta["hidden"], meta["ores"]
+        return {
+            "date" : slice(0, 3),
+            "ore1" : slice(3, 3 + shown),
+            "y" : 3 + shown,
+            "b" : 4 + shown,
+            "ore2" : slice(5 + shown, 5 + shown + hidden),
+            "ore1_mask" : slice(5 + shown + hidden, 5 + shown + hidden + ores),
+            "ore2_mask" : slice(5 + shown + hidden + ores, 5 + shown + hidden + 2 * ores)
+        }
+    
+    @property
+    def rows(self) -> int:
+        return self.meta["rows"]
+    
+    # Hash of the stored rows, kept up to date on every write
+    @property
+    def fingerprint(self) -> str:
+        return self.meta["hash"]
+    
+    @property
+    def width(self) -> int:
+        return MiningDataset.get_width(self.meta)
+    
+    @property
+    def columns(self) -> dict:
+        return MiningDataset.get_columns(self.meta)
+    
+    # Get the whole store as a read-only memory-mapped matrix
+    def load(self) -> np.ndarray:
+        if self.rows == 0:
+            return np.zeros((0, self.width), dtype=MiningDataset.dtype)
+        return np.memmap(self.data_file, dtype=MiningDataset.dtype, mode='r', shape=(self.rows, self.width))
+    
+    # Get a column or range of columns, without copying
+    def column(self, name) -> np.ndarray:
+        return self.load()[:, self.columns[name]]
+    
+    # Get the model features (date, shown ores, y, b), without copying
+    def features(self) -> np.ndarray:
+        return self.load()[:, :self.columns["ore2"].start]
+    
+    # Get the model labels (hidden ores), without copying
+    def labels(self) -> np.ndarray:
+        return self.load()[:, self.columns["ore2"]]
+    
+    # Turn a boolean mask per row into fixed-width ore indices, padded with -1
+    @staticmethod
+    def get_indices(mask, width) -> np.ndarray:
+        order = np.argsort(~mask, axis=1, kind="stable")[:, :width]
+        valid = np.arange(width) < mask.sum(axis=1).reshape(-1, 1)
+        return np.where(valid, order, -1)
+    
+    # Build the stored rows from dates, masks and leylines, in the given layout
+    @staticmethod
+    def encode(meta, dates, shown, hidden, y, b) -> np.ndarray:
+        data = np.zeros((len(dates), MiningDataset.get_width(meta)), dtype=MiningDataset.dtype)
+        columns = MiningDataset.get_columns(meta)
+        data[:, columns["date"]] = dates
+        data[:, columns["ore1"]] = MiningDataset.get_indices(shown, meta["shown"])
+        data[:, columns["y"]] = y
+        data[:, columns["b"]] = b
+        data[:, columns["ore2"]] = MiningDataset.get_indices(hidden, meta["hidden"])
+        data[:, columns["ore1_mask"]] = shown
+        data[:, columns["ore2_mask"]] = hidden
+        return data
+    
+    # Append rows, where ores holds the sheet value (1 shown, 2 hidden) of every ore per row, and leylines the amount of leyline positions
+    def append(self, dates, ores, y, b, last_row, last_date, leylines = 0):
+        dates = np.asarray(dates).reshape(-1, 3)
+        ores = np.asarray(ores).reshape(len(dates), -1)
+        shown = ores == 1
+        hidden = ores == 2
+        
+        meta = dict(self.meta)
+        meta["ores"] = max(meta["ores"], ores.shape[1])
+        meta["shown"] = max(meta["shown"], int(shown.sum(axis=1).max(initial=0)))
+        meta["hidden"] = max(meta["hidden"], int(hidden.sum(axis=1).max(initial=0)))
+        meta["leylines"] = max(meta.get("leylines", 0), leylines)
+        # Pad the masks if there are fewer ores than stored
+        shown = np.pad(shown, ((0, 0), (0, meta["ores"] - ores.shape[1])))
+        hidden = np.pad(hidden, ((0, 0), (0, meta["ores"] - ores.shape[1])))
+        new = MiningDataset.encode(meta, dates, shown, hidden, y, b)
+        
+        if self.rows and MiningDataset.get_width(meta) != self.width:
+            # The layout grew, so the stored rows are rewritten in the new layout
+            old = self.load()
+            columns = self.columns
+            pad = ((0, 0), (0, meta["ores"] - self.meta["ores"]))
+            old = MiningDataset.encode(meta, old[:, columns["date"]],
+                np.pad(old[:, columns["ore1_mask"]] == 1, pad), np.pad(old[:, columns["ore2_mask"]] == 1, pad),
+                old[:, columns["y"]], old[:, columns["b"]])
+            with open(self.data_file + ".tmp", 'wb') as f:
+                f.write(old.tobytes())
+                f.write(new.tobytes())
+            os.replace(self.data_file + ".tmp", self.data_file)
+        else:
+            with open(self.data_file, 'ab' if self.rows else 'wb') as f:
+                f.write(new.tobytes())
+        
+        meta["rows"] = self.rows + len(new)
+        meta["last_row"] = last_row
+        meta["last_date"] = last_date
+        meta["hash"] = self.get_hash()
+        self.write_meta(meta)
+    
+    # Hash the content of the data file
+    def get_hash(self) -> str:
+        h = hashlib.sha1()
+        with open(self.data_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        return h.hexdigest()
+    
+    # Replace the metadata file in one step, so it always matches the data file
+    def write_meta(self, meta):
+        with open(self.meta_file + ".tmp", 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(self.meta_file + ".tmp", self.meta_file)
+        self.meta = meta
+    
+    # Remove all stored rows
+    def reset(self):
+        for f in [self.data_file, self.meta_file]:
+            if isfile(f):
+                os.remove(f)
+        self.meta = MiningDataset.empty_meta()
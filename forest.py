@@ -0,0 +1,192 @@
+import os
+import sys
+import glob
+import json
+import shutil
+import numpy as np
+
+from os.path import isdir, isfile
+
+# Forests flattened into NumPy arrays, predicted without sklearn and memory-mapped when loaded
+# A forest is stored as groups of trees, a forest per output has a group per output and a jointly trained forest one group
+# Each group has the nodes of its trees one after another, and the class probabilities of its leaves
+class CompiledForest():
+    version = 2
+    arrays = ["feature", "threshold", "left", "right", "leaf", "roots", "value"]
+
+    def __init__(self, groups, classes, n_features, source = 0):
+        self.groups = groups
+        self.classes = [np.asarray(c) for c in classes]
+        self.n_features = n_features
+        self.source = source
+
+    # Flatten a MultiOutputRegressor of forests, or a forest trained on every output
+    @staticmethod
+    def compile(classifier, source = 0):
+        if hasattr(classifier, "classes_"):
+            classes = classifier.classes_ if classifier.n_outputs_ > 1 else [classifier.classes_]
+            groups = [CompiledForest.compile_group(classifier.estimators_, list(range(len(classes))), [len(c) for c in classes])]
+        else:
+            classes = [e.classes_ for e in classifier.estimators_]
+            groups = [CompiledForest.compile_group(e.estimators_, [o], [len(e.classes_)]) for o, e in enumerate(classifier.estimators_)]
+        return CompiledForest(groups, classes, classifier.n_features_in_, source)
+
+    # Flatten the trees of a forest, giving the outputs they predict and the amount of classes of each
+    @staticmethod
+    def compile_group(trees, outputs, n_classes) -> dict:
+        offsets = np.cumsum([0] + [t.tree_.node_count for t in trees])
+        width = max(n_classes)
+        feature, threshold, left, right, leaf, value = [], [], [], [], [], []
+        leaves = 0
+        for t, offset in zip(trees, offsets):
+            tree = t.tree_
+            is_leaf = tree.children_left == -1
+            feature.append(np.where(is_leaf, 0, tree.feature))
+            threshold.append(tree.threshold)
+            # Children point into the nodes of every tree, leaves point at themselves
+            left.append(np.where(is_leaf, np.arange(tree.node_count), tree.children_left) + offset)
+            right.append(np.where(is_leaf, np.arange(tree.node_count), tree.children_right) + offset)
+            leaf.append(np.where(is_leaf, np.cumsum(is_leaf) - 1 + leaves, -1))
+            leaves += int(is_leaf.sum())
+            value.append(CompiledForest.get_probabilities(tree.value[is_leaf], n_classes, width))
+        return {
+            "outputs" : outputs,
+            "feature" : np.concatenate(feature).astype(np.int32),
+            "threshold" : np.concatenate(threshold).astype(np.float64),
+            "left" : np.concatenate(left).astype(np.int32),
+            "right" : np.concatenate(right).astype(np.int32),
+            "leaf" : np.concatenate(leaf).astype(np.int32),
+            "roots" : offsets[:-1].astype(np.int32),
+            "value" : np.concatenate(value)
+        }
+
+    # Get the class probabilities of leaves the way sklearn does, padded to the same amount of classes
+    @staticmethod
+    def get_probabilities(value, n_classes, width) -> np.ndarray:
+        result = np.zeros((len(value), len(n_classes), width))
+        for k, c in enumerate(n_classes):
+            proba = value[:, k, :c].copy()
+            # Older versions of sklearn store the samples of each class instead of their fraction
+            normalizer = proba.sum(axis=1)[:, np.newaxis]
+            if (normalizer > 1 + 1e-9).any():
+                normalizer[normalizer == 0.0] = 1.0
+                proba /= normalizer
+            result[:, k, :c] = proba
+        return result
+
+    # Get the leaf each row ends up in, for every tree of a group
+    @staticmethod
+    def get_leaves(group, features) -> np.ndarray:
+        rows, trees = len(features), len(group["roots"])
+        # Every row goes down every tree at once, only moving the ones that are not in a leaf yet
+        nodes = np.tile(np.asarray(group["roots"]), rows)
+        starts = np.repeat(np.arange(rows) * features.shape[1], trees)
+        flat = features.ravel()
+        active = np.flatnonzero(group["leaf"][nodes] < 0)
+        while active.size:
+            current = nodes[active]
+            go_left = flat[starts[active] + group["feature"][current]] <= group["threshold"][current]
+            current = np.where(go_left, group["left"][current], group["right"][current])
+            nodes[active] = current
+            active = active[group["leaf"][current] < 0]
+        return group["leaf"][nodes].reshape(rows, trees)
+
+    # Predict every row of a 2-D feature matrix, returning the labels and their confidence like predict_classifier
+    def predict(self, features):
+        # sklearn compares the features as 32-bit floats
+        features = np.atleast_2d(np.asarray(features, dtype=np.float32))
+        # The trees read features by column, so a row of another width would be read from the wrong columns
+        if features.shape[1] != self.n_features:
+            raise ValueError(f"X has { features.shape[1] } features, but CompiledForest is expecting { self.n_features } features as input.")
+        probabilities = [None] * len(self.classes)
+        for group in self.groups:
+            leaves = CompiledForest.get_leaves(group, features)
+            value = group["value"]
+            for k, o in enumerate(group["outputs"]):
+                # Add the trees up one at a time, in the same order as sklearn, so the result is the same
+                proba = np.zeros((len(features), len(self.classes[o])))
+                for t in range(leaves.shape[1]):
+                    proba += value[leaves[:, t], k, :len(self.classes[o])]
+                proba /= leaves.shape[1]
+                probabilities[o] = proba
+        labels = np.stack([c[np.argmax(p, axis=1)] for c, p in zip(self.classes, probabilities)], axis=1)
+        confidence = np.stack([np.max(p, axis=1) for p in probabilities], axis=1)
+        return labels, confidence
+
+    # Write the arrays of the forest to a directory, replacing an outdated export of the same model in one step
+    def save(self, path):
+        temporary = path + ".tmp"
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+        for g, group in enumerate(self.groups):
+            for name in CompiledForest.arrays:
+                np.save(os.path.join(temporary, f"{ g }_{ name }.npy"), group[name])
+        meta = {
+            "version" : CompiledForest.version,
+            "source" : self.source,
+            "n_features" : self.n_features,
+            "outputs" : [g["outputs"] for g in self.groups],
+            "classes" : [c.tolist() for c in self.classes]
+        }
+        with open(os.path.join(temporary, "forest.json"), 'w') as f:
+            json.dump(meta, f)
+        if isdir(path):
+            shutil.rmtree(path + ".old", ignore_errors=True)
+            os.replace(path, path + ".old")
+        os.replace(temporary, path)
+        shutil.rmtree(path + ".old", ignore_errors=True)
+
+    # Read a forest from a directory, memory-mapping its arrays, or None if there is no usable export
+    @staticmethod
+    def load(path, source = None):
+        if not isfile(os.path.join(path, "forest.json")):
+            return None
+        with open(os.path.join(path, "forest.json")) as f:
+            meta = json.load(f)
+        # An export of another model than the one given is outdated
+        if meta["version"] != CompiledForest.version or (source is not None and meta["source"] != source):
+            return None
+        groups = []
+        for g, outputs in enumerate(meta["outputs"]):
+            group = { name : np.load(os.path.join(path, f"{ g }_{ name }.npy"), mmap_mode='r') for name in CompiledForest.arrays }
+            group["outputs"] = outputs
+            groups.append(group)
+        return CompiledForest(groups, meta["classes"], meta["n_features"], meta["source"])
+
+# Get the directory the compiled export of a nation's mining model is stored in
+# Each model gets its own directory, as a running program may still have the export of an older model memory-mapped, and mapped files can not be replaced on Windows
+def forest_dir(model_prefix, nation, source) -> str:
+    return model_prefix + nation.lower() + f"_mining.{ source }.forest"
+
+# Remove the exports of a nation's older models, the ones still mapped by a running program are removed next time
+def remove_stale(model_prefix, nation, source):
+    current = forest_dir(model_prefix, nation, source)
+    for path in glob.glob(model_prefix + glob.escape(nation.lower()) + "_mining*.forest*"):
+        if path != current:
+            shutil.rmtree(path, ignore_errors=True)
+
+# Get what a compiled model is made from, the time its model file was written
+def get_source(model_file) -> int:
+    return os.stat(model_file).st_mtime_ns
+
+# Compile the stored models of every nation, for models trained before they were compiled when training
+def main():
+    from joblib import load
+    import train
+    with open("config.json") as config:
+        data = json.load(config)
+    for n in data["nations"]:
+        path = train.model_file(data["model_prefix"], n)
+        if not isfile(path):
+            print(f"Forest: [{ n }] No model, skipping...")
+            continue
+        source = get_source(path)
+        if CompiledForest.load(forest_dir(data["model_prefix"], n, source), source) is not None:
+            print(f"Forest: [{ n }] Already compiled, skipping...")
+            continue
+        CompiledForest.compile(load(path), source).save(forest_dir(data["model_prefix"], n, source))
+        remove_stale(data["model_prefix"], n, source)
+        print(f"Forest: [{ n }] Compiled.")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import sys
+import time
+import numpy as np
+import logging as log
+
+import train
+import input
+import config
+import dataset
+import metrics
+
+# Exit statuses of a headless run
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_PARTIAL = 2
+
+# Runs autofill without a window, once or on a schedule, keeping the models and Sheets client loaded between runs
+class Runner():
+    def __init__(self, cfg:config.cfg) -> None:
+        self.cfg = cfg
+        self.input = input.Input(cfg)
+        self.input.warm_up()
+    
+    # Keep the data and models up to date when running for longer than a day
+    def update(self) -> None:
+        self.input.update_data()
+        if self.input.data_reset:
+            self.input.update_models()
+    
+    # Retrieve, predict and write every nation once, returning the exit status
+    def run_once(self) -> int:
+        start = time.perf_counter()
+        metrics.reset()
+        self.update()
+        
+        self.input.get_snapshot()
+        nations, _ = self.predict_nations(range(len(self.cfg.nations)))
+        
+        self.cfg.write_log(f"Headless: Autofill done in { time.perf_counter() - start:.2f}s ({ self.cfg.sheets.summary() })", log.info, True)
+        metrics.report(self.cfg)
+        return EXIT_OK if len(nations) == len(self.cfg.nations) else EXIT_PARTIAL
+    
+    # Predict and write the given nations from the last snapshot, returning the ones that were predicted and the ones that failed
+    def predict_nations(self, indices, important = True) -> tuple:
+        date = self.input.get_date()
+        # Only nations with a model, and their shown ores and leylines filled in can be predicted
+        nations = []
+        for i in indices:
+            if not self.input.model_mining[self.cfg.nations[i]].has_model:
+                self.cfg.write_log(f"Headless: [{ self.cfg.nations[i] }] No model, skipping...", log.warning, important)
+            elif self.input.ore_shown[i][0] < 0 or self.input.leyline_class[i][0] < 0:
+                self.cfg.write_log(f"Headless: [{ self.cfg.nations[i] }] Not enough data entered, skipping...", log.warning, important)
+            else:
+                nations.append(i)
+        
+        # Each nation is predicted on its own, so a row that can not be predicted does not stop the others
+        predicted = []
+        failed = []
+        for i in nations:
+            try:
+                labels, confidence = train.predict_records(self.input.model_mining, [(self.cfg.nations[i], date, self.input.ore_shown[i], self.input.leyline_class[i])])
+            except Exception as e:
+                self.cfg.write_log(f"Headless: [{ self.cfg.nations[i] }] Could not be predicted: { repr(e) }", log.error, True)
+                failed.append(i)
+                continue
+            predicted.append((i, labels[0], confidence[0]))
+        self.input.cache.save()
+        nations = [i for i, _, _ in predicted]
+        for i, l, c in predicted:
+            self.input.ore_hidden[i] = l.tolist()
+            self.input.ore_confidence[i] = c
+            self.cfg.write_log(f"Headless: [{ self.cfg.nations[i] }] { self.input.get_ore_hidden_formatted(i) } with { c.mean():.2%} confidence", log.info, important)
+        self.input.write_ore_hidden(nations)
+        return nations, failed
+    
+    # Run every given amount of minutes until interrupted, returning the status of the last run
+    def run_every(self, minutes) -> int:
+        status = EXIT_OK
+        try:
+            while True:
+                next_run = time.monotonic() + minutes * 60
+                try:
+                    status = self.run_once()
+                except Exception as e:
+                    # Keep the schedule going, the next run may succeed
+                    self.cfg.write_log(f"Headless: Autofill failed: { repr(e) }", log.error, True)
+                    status = EXIT_FAILED
+                time.sleep(max(0, next_run - time.monotonic()))
+        except KeyboardInterrupt:
+            self.cfg.write_log("Headless: Stopped.", log.info, True)
+        return status
+
+    # Check DataEntry every given amount of seconds, predicting and writing only the nations whose rows changed
+    def watch(self, seconds) -> int:
+        self.cfg.write_log(f"Headless: Watching DataEntry every { seconds }s...", log.info, True)
+        seen = {}
+        try:
+            while True:
+                next_check = time.monotonic() + seconds
+                try:
+                    self.check(seen)
+                except Exception as e:
+                    # Keep watching, the next check may succeed
+                    self.cfg.write_log(f"Headless: Check failed: { repr(e) }", log.error, True)
+                time.sleep(max(0, next_check - time.monotonic()))
+        except KeyboardInterrupt:
+            self.cfg.write_log("Headless: Stopped.", log.info, True)
+        return EXIT_OK
+    
+    # Read DataEntry once, and autofill the nations whose rows changed since the last check
+    def check(self, seen) -> None:
+        self.update()
+        self.input.get_snapshot()
+        changed = [i for i in range(len(self.cfg.nations)) if self.input.row_data[i] != seen.get(i)]
+        # Rows are only filled in once all of their shown ores are, and not if their hidden ores are already
+        ready = [i for i in changed if self.is_ready(i)]
+        failed = []
+        if ready:
+            start = time.perf_counter()
+            metrics.reset()
+            nations, failed = self.predict_nations(ready, False)
+            if nations:
+                names = ", ".join(self.cfg.nations[i] for i in nations)
+                self.cfg.write_log(f"Headless: Filled in { names } in { time.perf_counter() - start:.2f}s ({ self.cfg.sheets.summary() })", log.info, True)
+        # Remember the rows after writing, so the predictions written do not count as a change
+        # Rows that failed are not remembered, so they are tried again on the next check
+        for i in range(len(self.cfg.nations)):
+            if i not in failed:
+                seen[i] = list(self.input.row_data[i])
+    
+    # Whether a nation's row has as many shown ores as most rows of its data, and less hidden ores than the most stored
+    def is_ready(self, nation) -> bool:
+        data = dataset.MiningDataset(self.cfg.data_prefix, self.cfg.nations[nation])
+        if data.rows == 0:
+            return False
+        # Rows vary in how many ores are shown, so a row with fewer than the most ever stored can be complete
+        usual = np.bincount((np.asarray(data.column("ore1_mask")) == 1).sum(axis=1)).argmax()
+        shown = [x for x in self.input.ore_shown[nation] if x >= 0]
+        hidden = [x for x in self.input.ore_hidden[nation] if x >= 0]
+        return len(shown) >= usual and len(hidden) < data.meta["hidden"]
+
+def main() -> int:
+    cfg = config.cfg()
+    try:
+        runner = Runner(cfg)
+        if cfg.arg.watch:
+            return runner.watch(cfg.watch_interval)
+        return runner.run_every(cfg.arg.interval) if cfg.arg.interval > 0 else runner.run_once()
+    except Exception as e:
+        cfg.write_log(f"Headless: Autofill failed: { repr(e) }", log.error, True)
+        return EXIT_FAILED
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,110 +1,153 @@
 import re
-import json
-import time
+import threading
 import logging as log
 from datetime import datetime as date
+from gspread.utils import rowcol_to_a1
 
+import cache
 import train
 import config
 import retrieve
+import validate
 
 class Input():
     def __init__(self, cfg:config.cfg) -> None:
         self.cfg = cfg
         
-        self.data_reset = self.cfg.force_data_reset or (date.now() - date.fromtimestamp(self.cfg.timestamp)).days >= self.cfg.data_days or cfg.arg.update
-        if self.data_reset:
-            self.cfg.write_log("Input: Reseting data...", log.info, True)
-            retrieve.DataRetriever(cfg).retrieve_mining_data()
-        
-        self.cfg.write_log("Input: Retrieving AI models...", log.info)
         self.model_leyline = {}
         self.model_mining = {}
-        if self.cfg.force_model_reset or self.data_reset:
-            self.cfg.write_log("Input: Initialing model reset...", log.warning, True)
-        for n in self.cfg.nations:
-            self.model_mining[n] = train.MiningTrainer(n, self.cfg.force_model_reset or self.data_reset, cfg)
+        self.cache = cache.PredictionCache(cfg)
+        self.update_data(self.cfg.force_data_reset or cfg.arg.update)
+        if cfg.arg.errorcheck:
+            validate.run(self.cfg)
+        self.update_models(self.cfg.force_model_reset)
         if self.cfg.force_model_reset:
-            data = {}
-            with open("config.json", 'r') as d:
-                data = json.load(d)
-            data["force_model_reset"] = False
-            with open("config.json", 'w') as d:
-                json.dump(data, d, indent=2)
+            self.cfg.write("force_model_reset", False)
+            self.cfg.force_model_reset = False
         
         # Initialize cached data
         self.ore_shown = {}
         self.ore_hidden = {}
         self.leyline_url = {}
         self.leyline_class = {}
+        self.ore_confidence = {}
+        self.row_data = {}
+        self.ore_data = {}
         
-        # Initialize sheets data
-        self.leyline_col = self.cfg.sheet.find("Leyline Positions", 1).col
-        self.ending_col = self.cfg.sheet.find("Options:", 1).col - 3
+        # Sheets layout, looked up on first access
+        self.leyline_col = None
+        self.ending_col = None
         
         self.cfg.write_log("Input: Ready", log.info)
         
-    def try_access_sheets(self, f):
-        while True:
-            try:
-                ret = f()
-                return ret
-            except:
-                time.sleep(60)
+    # Whether the stored data is older than the configured amount of days
+    def is_data_outdated(self) -> bool:
+        return (date.now() - date.fromtimestamp(self.cfg.model_data["Data"])).days >= self.cfg.data_days
+    
+    # Sync the stored data with the sheet, if it is outdated or forced
+    def update_data(self, force = False) -> None:
+        self.data_reset = force or self.is_data_outdated()
+        if self.data_reset:
+            self.cfg.write_log("Input: Reseting data...", log.info, True)
+            retrieve.DataRetriever(self.cfg).retrieve_mining_data()
+    
+    # Retrain the models whose data or training settings changed, or all of them if forced
+    def update_models(self, force = False) -> None:
+        self.cfg.write_log("Input: Retrieving AI models...", log.info)
+        outdated = self.cfg.nations if force else train.get_outdated(self.cfg)
+        if outdated:
+            self.cfg.write_log(f"Input: Initialing model reset for { ', '.join(outdated) }...", log.warning, True)
+            train.train_mining_models(outdated, self.cfg, force)
+        for n in self.cfg.nations:
+            if n in outdated or n not in self.model_mining:
+                self.model_mining[n] = train.MiningTrainer(n, False, self.cfg, self.cache)
     
     # Get the current date, compared to the start date of the nation's data
     def get_date(self) -> list:
+        current_day = date.today()
+        # Return the difference in days between the current day and the start date
+        self.date = [current_day.year, current_day.month, current_day.day]
+        return self.date
+    
+    # Look up the columns of DataEntry, if they have not been already
+    def get_layout(self) -> None:
+        if self.leyline_col is None:
+            self.leyline_col = self.cfg.sheets.call(lambda: self.cfg.sheet.find("Leyline Positions", 1), "find").col
+            self.ending_col = self.cfg.sheets.call(lambda: self.cfg.sheet.find("Options:", 1), "find").col - 3
+    
+    # Get the sheet row of a nation in DataEntry
+    def get_row(self, nation: int) -> int:
+        return (nation + 1) * 3
+    
+    # Read every nation's row in DataEntry with a single request
+    def get_snapshot(self) -> None:
+        self.get_layout()
         def f():
-            current_day = date.today()
-            # Return the difference in days between the current day and the start date
-            self.date = [current_day.year, current_day.month, current_day.day]
-            return self.date
-        return self.try_access_sheets(f)
+            ranges = [rowcol_to_a1(self.get_row(n), 1) + ":" + rowcol_to_a1(self.get_row(n), self.ending_col - 1) for n in range(len(self.cfg.nations))]
+            return self.cfg.sheet.batch_get(ranges)
+        data = self.cfg.sheets.call(f, "batch_get")
+        for nation, values in enumerate(data):
+            # Pad the row, as trailing empty cells are not returned
+            row = list(values[0]) if values else []
+            self.row_data[nation] = row + [''] * (self.ending_col - 1 - len(row))
+            # Extract integers from the ore data
+            self.ore_data[nation] = [(int(x) if re.search('[0-9]', x) else '') for x in self.row_data[nation][:self.leyline_col - 1]]
+            self.get_ore_shown(nation)
+            self.get_ore_hidden(nation)
+            self.get_leyline_class(nation)
     
     # Get the leyline classifications
     def get_leyline_class(self, nation: int) -> list:
-        def f():
-            # Get the relevant data
-            row = (nation + 1) * 3
-            data = [x.value for x in self.cfg.sheet.range(row, self.leyline_col, row, self.ending_col - 1)]
-            # Get indexes of 'y' and 'b', otherwise return negative
-            self.leyline_class[nation] = [data.index('y'), data.index('b')] if 'y' in data and 'b' in data else [-2, -2]
-            return self.leyline_class[nation]
-        return self.try_access_sheets(f)
+        data = self.row_data[nation][self.leyline_col - 1:self.ending_col - 1]
+        # Get indexes of 'y' and 'b', otherwise return negative
+        self.leyline_class[nation] = [data.index('y'), data.index('b')] if 'y' in data and 'b' in data else [-2, -2]
+        return self.leyline_class[nation]
     
     # Get the shown ores (1)
     def get_ore_shown(self, nation: int) -> list:
-        def f():
-            # Get the relevant data
-            row = (nation + 1) * 3
-            data = self.cfg.sheet.range(row, 1, row, self.leyline_col - 1)
-            # Extract integers from the data
-            data = [(int(x.value) if re.search('[0-9]', x.value) else '') for x in data]
-            # Get the index of all 1s in the data, if none return negative
-            self.ore_shown[nation] = [i for i, x in enumerate(data) if x == 1] if 1 in data else [-2]
-            return self.ore_shown[nation]
-        return self.try_access_sheets(f)
+        data = self.ore_data[nation]
+        # Get the index of all 1s in the data, if none return negative
+        self.ore_shown[nation] = [i for i, x in enumerate(data) if x == 1] if 1 in data else [-2]
+        return self.ore_shown[nation]
     
     # Get the hidden ores (2)
     def get_ore_hidden(self, nation: int) -> list:
-        def f():
-            # Get the relevant data
-            row = (nation + 1) * 3
-            data = self.cfg.sheet.range(row, 1, row, self.leyline_col - 1)
-            # Extract integers from the data
-            data = [(int(x.value) if re.search('[0-9]', x.value) else '') for x in data]
-            # Get the index of all 2s in the data, if none return negative
-            self.ore_hidden[nation] = [i for i, x in enumerate(data) if x == 2] if 2 in data else [-2]
-            return self.ore_hidden[nation]
-        return self.try_access_sheets(f)
+        data = self.ore_data[nation]
+        # Get the index of all 2s in the data, if none return negative
+        self.ore_hidden[nation] = [i for i, x in enumerate(data) if x == 2] if 2 in data else [-2]
+        return self.ore_hidden[nation]
     
-    # Write the hidden ores (2)
-    def write_ore_hidden(self, nation: int) -> None:
+    # Write the hidden ores (2) of the given nations with a single request
+    def write_ore_hidden(self, nations: list) -> None:
+        # Only write to cells that were empty in the last snapshot
+        cells = [(n, c) for n in nations if n in self.row_data for c in self.ore_hidden[n] if c >= 0 and not self.row_data[n][c]]
+        if not cells:
+            return
         def f():
             # Update the relevant cells
-            row = (nation + 1) * 3
-            [self.cfg.sheet.update_cell(row, c + 1, '2') for c in self.ore_hidden[nation] if not self.cfg.sheet.cell(row, c + 1).value]
-        return self.try_access_sheets(f)
+            data = [{ "range" : rowcol_to_a1(self.get_row(n), c + 1), "values" : [['2']] } for n, c in cells]
+            self.cfg.sheet.batch_update(data, value_input_option="USER_ENTERED")
+        self.cfg.sheets.call(f, "batch_update")
+        # Keep the snapshot in line with the sheet, so writing again changes nothing
+        for n, c in cells:
+            self.row_data[n][c] = '2'
+            self.ore_data[n][c] = 2
+    
+    # Load every model in the background, so the first prediction does not have to
+    def warm_up(self) -> threading.Thread:
+        def f():
+            for n, m in self.model_mining.items():
+                if not m.has_model:
+                    continue
+                # A model that can not be loaded is logged, so the ones after it are still loaded
+                try:
+                    m.classifier
+                except Exception as e:
+                    self.cfg.write_log(f"Input: [{ n }] Could not load model: { repr(e) }", log.error, True)
+            self.cfg.write_log("Input: Models loaded", log.info)
+        thr = threading.Thread(target=f, daemon=True)
+        thr.start()
+        return thr
     
     # Format the shown ores in a displayable format
     def get_ore_shown_formatted(self, nation: int) -> str:
@@ -1,5 +1,8 @@
 import time
-import threading
+
+# Measure startup from before the heavier imports
+start_time = time.perf_counter()
+
 import webbrowser
 import logging as log
 from tkinter import *
@@ -7,19 +10,24 @@ from tkinter import ttk, font
 
 import input
 import config
+import metrics
+import pipeline
 
 class Interface():
     def __init__(self, cfg:config.cfg) -> None:        
-        cfg.write_log("Interface: Initializing input...", log.info)
         self.cfg = cfg
-        self.input = input.Input(cfg)
+        self.input = None
             
         cfg.write_log("Interface: Initializing structure...", log.info)
         self.define_inital()
         
         cfg.write_log("Interface: Initializing data...", log.info)
         self.define_data()
-        cfg.write_log("Interface: Ready.", log.info, True)
+        self.root.after(0, lambda: cfg.write_log(f"Interface: Window shown after { time.perf_counter() - start_time:.2f}s", log.info, True))
+        
+        # Set up input in the background, anything queued afterwards waits for it
+        cfg.write_log("Interface: Initializing input...", log.info)
+        self.queue(lambda start: self.executor.submit(self.initialize_input, after=[start]))
         
         if cfg.arg.autofill:
             cfg.write_log("Interface: Autofill started...", log.info)
@@ -46,9 +54,8 @@ class Interface():
         # Variable setup
         self.nations = self.cfg.nations
         self.var = {}
-        self.thread_queue = []
-        self.queue_num = 0
-        self.queue_processing = 0
+        self.executor = pipeline.StagedExecutor(self.cfg, 1 if self.cfg.arg.singlethread else self.cfg.worker_threads)
+        self.pending = self.executor.when_done([])
     
     # Define variables that shown and interact with data
     def define_data(self):
@@ -82,98 +89,119 @@ class Interface():
         [self.buttonframe.columnconfigure(i, weight=1) for i in range(0,5)]
         ttk.Button(self.buttonframe, text="Write Mining", command=self.write_mining).grid(row=0,column=4,sticky='SEW')
     
+    # Set up input and start loading the models
+    def initialize_input(self):
+        self.input = input.Input(self.cfg)
+        self.input.warm_up()
+        self.cfg.write_log(f"Interface: Ready after { time.perf_counter() - start_time:.2f}s", log.info, True)
+        metrics.report(self.cfg)
+    
     # Retrieve data from the Google Sheet
     def retrieve_data(self):
-        def indiv_retrieve_data(self, nation, index):
-            # Retrieve data
-            self.input.get_ore_shown(index)
-            self.input.get_ore_hidden(index)
-            self.input.get_leyline_class(index)
-            self.input.get_date()
-            # Display data
-            self.var[f"{nation}_ore_1"].set(self.input.get_ore_shown_formatted(index))
-            self.var[f"{nation}_ore_2"].set(self.input.get_ore_hidden_formatted(index))
-            self.var[f"{nation}_ley_yb"].set(self.input.get_leyline_class_formatted(index))
+        def build(start):
+            snapshot = self.executor.submit(self.get_snapshot, after=[start])
+            return self.executor.when_done([self.executor.submit(self.show_retrieved, n, i, after=[snapshot]) for i, n in enumerate(self.nations)])
         
-        self.start_thread_queue(indiv_retrieve_data, self.nations)
+        self.queue(build)
     
     # Poll the AI to see where it thinks the hidden ores are in the world
     def poll_mining_ai(self):
-        def indiv_poll_mining_ai(self, nation, index):
-            # Get relevant data
-            date = self.input.date
-            ore_shown = self.input.ore_shown[index]
-            leylines = self.input.leyline_class[index]
-            # Check if enough data has been recieved
-            if ore_shown[0] >= 0 and leylines[0] >= 0:
-                # Poll Mining AI
-                result = self.input.model_mining[nation].predict(date + ore_shown + leylines)
-                self.input.ore_hidden[index] = result.tolist()
-                result = [x + 1 for x in result]
-                # Format and display result
-                self.var[f"{nation}_ore_g"].set("[" + ", ".join("{:2}".format(x) for x in result) + "]")
+        def build(start):
+            predicted = self.executor.when_done([self.executor.submit(self.predict_nation, n, i, after=[start]) for i, n in enumerate(self.nations)])
+            return self.executor.submit(self.save_predictions, after=[predicted])
         
-        self.start_thread_queue(indiv_poll_mining_ai, self.nations)
+        self.queue(build)
     
     # Write mining data recieved from AI to the Google sheet
     def write_mining(self):
-        def indiv_write_mining(self, nation, index):
-            # Check if AI has been run
-            if self.input.ore_hidden[index]:
-                self.input.write_ore_hidden(index)
-                self.var[f"{nation}_ore_2"].set(self.var[f"{nation}_ore_g"].get())
+        def build(start):
+            return self.executor.submit(self.write_nations, range(len(self.nations)), after=[start])
         
-        self.start_thread_queue(indiv_write_mining, self.nations)
+        self.queue(build)
     
     def print_info(self):
-        def print_func(self, nation, index):
-            cfg.write_log("Interface: Confidence data:", log.info)
-            length = len(sorted(self.nations, key=len)[-1])
-            for n in self.nations:
-                cfg.write_log(f"Interface: [{ n }] {' ' * (length - len(n))}: { self.input.model_mining[n].confidence * 100 :.2f}%", log.info)
-            cfg.write_log("Interface: Autofill done", log.info)
+        def build(start):
+            return self.executor.submit(self.print_confidence, after=[start])
         
-        self.start_thread_queue(print_func, { "print" })
+        self.queue(build)
     
-    # Run all operations sequentially
+    # Run all operations, chained per nation so nations do not wait on each other
     def autofill(self):
-        self.retrieve_data()
-        self.poll_mining_ai()
-        self.write_mining()
-        self.print_info()
-    
-    # Start a thread per entry in the enumerable
-    def start_thread_queue(self, func, enumerable):
-        def start_threads(self):
-            for i, n in enumerate(enumerable):
-                thr = threading.Thread(target=func, args=(self, n, i))
-                self.thread_queue.append(thr)
-                thr.start()
-        
-        if not self.cfg.arg.singlethread:
-            thr = threading.Thread(target=self.wait_for_queue, args=(self.queue_num, start_threads))
-            thr.start()
-            self.queue_num += 1
-        else:
-            for i, n in enumerate(enumerable):
-                func(self, n, i)
-    
-    # Wait for all queue entries to finish
-    def wait_for_queue(self, queue_num, callback):
-        while self.queue_processing != queue_num:
-            time.sleep(0.1)
+        def build(start):
+            start = self.executor.submit(metrics.reset, after=[start])
+            snapshot = self.executor.submit(self.get_snapshot, after=[start])
+            chains = []
+            for i, n in enumerate(self.nations):
+                shown = self.executor.submit(self.show_retrieved, n, i, after=[snapshot])
+                predicted = self.executor.submit(self.predict_nation, n, i, after=[shown])
+                chains.append(self.executor.submit(self.write_nations, [i], after=[predicted]))
+            done = self.executor.when_done(chains)
+            self.executor.submit(self.save_predictions, after=[done])
+            return self.executor.submit(self.print_confidence, after=[done])
         
-        all_dead = False
-        while not all_dead:
-            time.sleep(0.1)
-            all_dead = True
-            for t in self.thread_queue:
-                t.join(1)
-                all_dead &= not t.is_alive()
-        
-        self.thread_queue = []
-        callback(self)
-        self.queue_processing = queue_num + 1
+        self.queue(build)
+    
+    # Queue an operation to start after the previous one, build returns the future of its last stage
+    def queue(self, build):
+        self.pending = build(self.executor.when_done([self.pending]))
+    
+    # Retrieve data for all nations at once
+    def get_snapshot(self):
+        self.input.get_snapshot()
+        self.input.get_date()
+    
+    # Display the retrieved data of a nation
+    def show_retrieved(self, nation, index):
+        self.show(f"{nation}_ore_1", self.input.get_ore_shown_formatted(index))
+        self.show(f"{nation}_ore_2", self.input.get_ore_hidden_formatted(index))
+        self.show(f"{nation}_ley_yb", self.input.get_leyline_class_formatted(index))
+    
+    # Poll the Mining AI of a nation
+    def predict_nation(self, nation, index):
+        # Get relevant data
+        date = self.input.date
+        ore_shown = self.input.ore_shown[index]
+        leylines = self.input.leyline_class[index]
+        model = self.input.model_mining[nation]
+        # Check if enough data has been recieved, and there is a model to poll
+        if ore_shown[0] >= 0 and leylines[0] >= 0 and model.has_model:
+            # Poll Mining AI
+            result, confidence = model.predict(model.get_features(date, ore_shown, leylines))
+            self.input.ore_hidden[index] = result.tolist()
+            self.input.ore_confidence[index] = confidence
+            result = [x + 1 for x in result]
+            # Format and display result
+            self.show(f"{nation}_ore_g", "[" + ", ".join("{:2}".format(x) for x in result) + "]")
+    
+    # Keep the predictions for the next poll and the next start
+    def save_predictions(self):
+        self.input.cache.save()
+    
+    # Write the predictions of the given nations to the sheet
+    def write_nations(self, indices):
+        # Check if AI has been run
+        indices = [i for i in indices if self.input.ore_hidden.get(i)]
+        self.input.write_ore_hidden(indices)
+        for i in indices:
+            self.show(f"{self.nations[i]}_ore_2", self.input.get_ore_hidden_formatted(i))
+    
+    # Log the confidence of the last predictions
+    def print_confidence(self):
+        self.cfg.write_log("Interface: Confidence data:", log.info)
+        length = len(sorted(self.nations, key=len)[-1])
+        for i, n in enumerate(self.nations):
+            if i in self.input.ore_confidence:
+                self.cfg.write_log(f"Interface: [{ n }] {' ' * (length - len(n))}: { self.input.ore_confidence[i].mean() * 100 :.2f}%", log.info)
+        self.cfg.write_log("Interface: Autofill done", log.info)
+        metrics.report(self.cfg)
+    
+    # Set a displayed variable from the Tk main loop, as workers may not touch Tk themselves
+    def show(self, name, value):
+        queued = time.perf_counter()
+        def update():
+            metrics.add_time("tk.dispatch", time.perf_counter() - queued)
+            self.var[name].set(value)
+        self.root.after(0, update)
     
     # Create a string variable and store it in a dictionary
     def create_str_var(self, name: str, starting_val: str = "") -> StringVar:
@@ -188,6 +216,7 @@ class Interface():
     # Run the main loop for the application
     def main_loop(self):
         self.root.mainloop()
+        self.executor.shutdown()
 
 # Change font when hovered subfunction
 def hover_font(widget, color, font, event):
@@ -0,0 +1,204 @@
+import json
+import time
+import random
+import argparse
+import threading
+import numpy as np
+
+from datetime import datetime as date, timedelta
+from gspread.cell import Cell
+from gspread.exceptions import APIError
+from gspread.utils import a1_range_to_grid_range
+
+# Stand-in for the response of a failed Google Sheets request
+class LocalResponse():
+    def __init__(self, status_code, message):
+        self.status_code = status_code
+        self.text = message
+    
+    def json(self):
+        return { "error" : { "code" : self.status_code, "message" : self.text, "status" : "RESOURCE_EXHAUSTED" } }
+
+# In-memory stand-in for a Google spreadsheet, optionally backed by a JSON file
+class LocalSpreadsheet():
+    def __init__(self, sheets = None, latency = 0, error_rate = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.sheets = { title : LocalWorksheet(self, title, values) for title, values in (sheets or {}).items() }
+    
+    # Act like a request to Google, waiting for the latency and failing with the error rate
+    def request(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            raise APIError(LocalResponse(429, "Quota exceeded (local stand-in)"))
+    
+    def worksheet(self, title):
+        self.request()
+        return self.sheets[title]
+    
+    def worksheets(self):
+        self.request()
+        return list(self.sheets.values())
+    
+    # Create an empty worksheet
+    def add_worksheet(self, title):
+        self.sheets[title] = LocalWorksheet(self, title, [])
+        return self.sheets[title]
+    
+    # Read a spreadsheet from a JSON file of { title : rows of values }
+    @staticmethod
+    def open(path, latency = 0, error_rate = 0):
+        with open(path) as f:
+            return LocalSpreadsheet(json.load(f), latency, error_rate)
+    
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({ title : sheet.values for title, sheet in self.sheets.items() }, f)
+    
+    # Fill the spreadsheet with random data in the layout of DataEntry and the "<Nation> Data" sheets
+    def seed(self, nations, days, ores = 12, shown = 3, hidden = 2, leylines = 6, seed = 0):
+        rng = np.random.default_rng(seed)
+        entry = self.add_worksheet("DataEntry")
+        # DataEntry has the ores from the first column, then the leylines, then the options
+        header = [f"Ore { i + 1 }" for i in range(ores)] + ["Leyline Positions"] + [''] * (leylines + 2) + ["Options:"]
+        entry.set_row(1, header)
+        today = date.today()
+        for i, n in enumerate(nations):
+            sheet = self.add_worksheet(n + " Data")
+            # The nation sheets have the date first, and the column after the leylines is headed "2"
+            sheet.set_row(1, ["Date"] + [f"Ore { j + 1 }" for j in range(ores)] + ["Leyline Positions"] + [''] * (leylines - 1) + ["2"])
+            sheet.set_row(2, [''])
+            for d in range(days):
+                ore_row, leyline_row = LocalSpreadsheet.random_row(rng, ores, shown, hidden, leylines)
+                day = today - timedelta(days=days - 1 - d)
+                sheet.set_row(3 + d, [day.strftime("%m/%d/%y")] + ore_row + leyline_row)
+            # Today's entry only has the shown ores, the hidden ones are left to predict
+            ore_row, leyline_row = LocalSpreadsheet.random_row(rng, ores, shown, hidden, leylines)
+            entry.set_row((i + 1) * 3, [x if x == '1' else '' for x in ore_row] + leyline_row)
+        return self
+    
+    # Get the ore and leyline cells of a random row, with the hidden ores depending on the shown ones
+    @staticmethod
+    def random_row(rng, ores, shown, hidden, leylines):
+        order = rng.permutation(ores)
+        y, b = rng.choice(leylines, 2, replace=False)
+        rest = sorted(order[shown:])
+        hidden = [rest[(int(y) + j) % len(rest)] for j in range(hidden)]
+        ore_row = ['1' if j in order[:shown] else '2' if j in hidden else '' for j in range(ores)]
+        leyline_row = ['y' if j == y else 'b' if j == b else '' for j in range(leylines)]
+        return ore_row, leyline_row
+
+# In-memory stand-in for a gspread Worksheet, implementing the calls the classifier uses
+class LocalWorksheet():
+    def __init__(self, spreadsheet, title, values):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.values = [list(row) for row in values]
+    
+    # Get a cell value, empty outside of the stored values
+    def get_value(self, row, col) -> str:
+        return self.values[row - 1][col - 1] if row <= len(self.values) and col <= len(self.values[row - 1]) else ''
+    
+    # Set a cell value, growing the stored values as needed
+    def set_value(self, row, col, value):
+        while len(self.values) < row:
+            self.values.append([])
+        while len(self.values[row - 1]) < col:
+            self.values[row - 1].append('')
+        self.values[row - 1][col - 1] = str(value)
+    
+    # Set the values of a row from the first column on
+    def set_row(self, row, values):
+        for c, v in enumerate(values):
+            self.set_value(row, c + 1, v)
+    
+    # Get the rows and columns of an A1 range, like "B3:D5"
+    @staticmethod
+    def get_bounds(name):
+        grid = a1_range_to_grid_range(name)
+        return grid["startRowIndex"] + 1, grid["startColumnIndex"] + 1, grid["endRowIndex"], grid["endColumnIndex"]
+    
+    # Get the values of a range, with trailing empty cells left out like Google does
+    def get_values(self, first_row, first_col, last_row, last_col) -> list:
+        rows = [[self.get_value(r, c) for c in range(first_col, last_col + 1)] for r in range(first_row, last_row + 1)]
+        for row in rows:
+            while row and not row[-1]:
+                row.pop()
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+    
+    def find(self, query, in_row = None, in_column = None, case_sensitive = True):
+        self.spreadsheet.request()
+        with self.spreadsheet.lock:
+            for r, row in enumerate(self.values):
+                for c, v in enumerate(row):
+                    if (in_row is None or in_row == r + 1) and (in_column is None or in_column == c + 1) and (v == query if case_sensitive else v.lower() == query.lower()):
+                        return Cell(r + 1, c + 1, v)
+        return None
+    
+    def range(self, first_row, first_col = None, last_row = None, last_col = None):
+        self.spreadsheet.request()
+        if isinstance(first_row, str):
+            first_row, first_col, last_row, last_col = LocalWorksheet.get_bounds(first_row)
+        with self.spreadsheet.lock:
+            return [Cell(r, c, self.get_value(r, c)) for r in range(first_row, last_row + 1) for c in range(first_col, last_col + 1)]
+    
+    def col_values(self, col):
+        self.spreadsheet.request()
+        with self.spreadsheet.lock:
+            values = [self.get_value(r + 1, col) for r in range(len(self.values))]
+        while values and not values[-1]:
+            values.pop()
+        return values
+    
+    def row_values(self, row):
+        self.spreadsheet.request()
+        with self.spreadsheet.lock:
+            values = self.get_values(row, 1, row, len(self.values[row - 1]) if row <= len(self.values) else 0)
+        return values[0] if values else []
+    
+    def cell(self, row, col):
+        self.spreadsheet.request()
+        with self.spreadsheet.lock:
+            return Cell(row, col, self.get_value(row, col))
+    
+    def update_cell(self, row, col, value):
+        self.spreadsheet.request()
+        with self.spreadsheet.lock:
+            self.set_value(row, col, value)
+    
+    def get(self, name):
+        self.spreadsheet.request()
+        with self.spreadsheet.lock:
+            return self.get_values(*LocalWorksheet.get_bounds(name))
+    
+    def batch_get(self, ranges):
+        self.spreadsheet.request()
+        with self.spreadsheet.lock:
+            return [self.get_values(*LocalWorksheet.get_bounds(name)) for name in ranges]
+    
+    def batch_update(self, data, value_input_option = None):
+        self.spreadsheet.request()
+        with self.spreadsheet.lock:
+            for entry in data:
+                first_row, first_col, _, _ = LocalWorksheet.get_bounds(entry["range"])
+                for r, row in enumerate(entry["values"]):
+                    for c, v in enumerate(row):
+                        self.set_value(first_row + r, first_col + c, v)
+
+# Write a seeded spreadsheet to a file, to be used with the "local" sheet backend
+def main():
+    parser = argparse.ArgumentParser(prog="Local Sheet", description="Creates a local stand-in for the Google spreadsheet")
+    parser.add_argument('-d', '--days', dest="days", default=365, help="how many days of data each nation has", type=int)
+    parser.add_argument('-o', '--output', dest="output", default="local_sheet.json", help="what file the spreadsheet is written to", type=str)
+    parser.add_argument('-s', '--seed', dest="seed", default=0, help="the seed of the random data", type=int)
+    arg = parser.parse_args()
+    with open("config.json") as config:
+        nations = json.load(config)["nations"]
+    LocalSpreadsheet().seed(nations, arg.days, seed=arg.seed).save(arg.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import os
+import json
+import atexit
+import threading
+
+from os.path import isfile
+
+# A JSON file kept in memory, shared by every thread that updates it
+# Updates are written together once none have come in for the delay, by replacing the file in one step
+class MetadataStore():
+    def __init__(self, path, delay = 1, default = None):
+        self.path = path
+        self.delay = delay
+        self.lock = threading.RLock()
+        self.timer = None
+        self.changed = False
+        self.created = not isfile(path)
+        if self.created and default is not None:
+            self.data = dict(default)
+            self.flush(True)
+        else:
+            with open(path) as f:
+                self.data = json.load(f)
+        # Write whatever is left when the program exits
+        atexit.register(self.flush)
+
+    def get(self, key, default = None):
+        return self.data.get(key, default)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self.data
+
+    # Set several values at once, they are written together
+    def update(self, values: dict):
+        with self.lock:
+            self.data.update(values)
+            self.changed = True
+            self.schedule()
+
+    def set(self, key, value):
+        self.update({ key : value })
+
+    # Restart the countdown to the next write, so a burst of updates is written once
+    def schedule(self):
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.delay <= 0:
+            self.flush()
+            return
+        self.timer = threading.Timer(self.delay, self.flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    # Write the values to the file now, if any changed
+    def flush(self, force = False):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.changed and not force:
+                return
+            # Write a temporary file first, so the file is never left half written
+            with open(self.path + ".tmp", 'w') as f:
+                json.dump(self.data, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.path + ".tmp", self.path)
+            self.changed = False
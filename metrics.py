@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import threading
+import logging as log
+from contextlib import contextmanager
+
+# Counters and timers of the current run, keyed by name and labels
+lock = threading.Lock()
+counters = {}
+timers = {}
+
+# Get the key of a metric, labels like nation="Liyue" are kept sorted
+def get_key(name, labels) -> tuple:
+    return (name, tuple(sorted(labels.items())))
+
+# Add to a counter
+def count(name, amount = 1, **labels):
+    key = get_key(name, labels)
+    with lock:
+        counters[key] = counters.get(key, 0) + amount
+
+# Add a measured duration to a timer
+def add_time(name, seconds, **labels):
+    key = get_key(name, labels)
+    with lock:
+        calls, total, longest = timers.get(key, (0, 0, 0))
+        timers[key] = (calls + 1, total + seconds, max(longest, seconds))
+
+# Time the code in a with block
+@contextmanager
+def timer(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - start, **labels)
+
+# Forget everything measured, at the start of a run
+def reset():
+    with lock:
+        counters.clear()
+        timers.clear()
+
+# Get everything measured so far, in a form that can be sent between processes
+def snapshot() -> dict:
+    with lock:
+        return { "counters" : dict(counters), "timers" : dict(timers) }
+
+# Add the measurements of another process, like a training worker
+def merge(other):
+    for key, amount in other["counters"].items():
+        count(key[0], amount, **dict(key[1]))
+    for key, (calls, total, longest) in other["timers"].items():
+        with lock:
+            old = timers.get(key, (0, 0, 0))
+            timers[key] = (old[0] + calls, old[1] + total, max(old[2], longest))
+
+# Get the name of a metric with its labels, like "model.load{nation=Liyue}"
+def get_label(key) -> str:
+    return key[0] + ("{" + ",".join(f"{k}={v}" for k, v in key[1]) + "}" if key[1] else "")
+
+# Summarize the run, with the timers that took the longest first
+def summary() -> dict:
+    data = snapshot()
+    return {
+        "counters" : { get_label(k) : v for k, v in sorted(data["counters"].items()) },
+        "timers" : { get_label(k) : { "count" : c, "total_s" : t, "mean_s" : t / c, "max_s" : m } for k, (c, t, m) in sorted(data["timers"].items(), key=lambda x: -x[1][1]) }
+    }
+
+# Log the summary of the run, and export it if a metrics file is configured
+def report(cfg):
+    data = summary()
+    for name, t in data["timers"].items():
+        cfg.write_log(f"Metrics: { name }: { t['count'] }x, { t['total_s']:.3f}s total, { t['max_s']:.3f}s max", log.info)
+    for name, amount in data["counters"].items():
+        cfg.write_log(f"Metrics: { name }: { amount }", log.info)
+    if cfg.metrics_file:
+        export(cfg.metrics_file)
+
+# Write the metrics to a file, as a Prometheus textfile if it ends in .prom and as JSON otherwise
+def export(path):
+    if path.endswith(".prom"):
+        text = get_prometheus()
+    else:
+        text = json.dumps(summary(), indent=2)
+    # Replace the file in one step, so a collector never reads half of it
+    with open(path + ".tmp", 'w') as f:
+        f.write(text)
+    os.replace(path + ".tmp", path)
+
+# Format the metrics in the Prometheus text format
+def get_prometheus() -> str:
+    def metric(name, labels):
+        name = "leyline_" + name.replace(".", "_")
+        return name, ("{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else "")
+    
+    data = snapshot()
+    lines = []
+    for (name, labels), amount in sorted(data["counters"].items()):
+        name, labels = metric(name, labels)
+        lines.append(f"{ name }_total{ labels } { amount }")
+    for (name, labels), (calls, total, longest) in sorted(data["timers"].items()):
+        name, labels = metric(name, labels)
+        lines.append(f"{ name }_seconds_sum{ labels } { total }")
+        lines.append(f"{ name }_seconds_count{ labels } { calls }")
+        lines.append(f"{ name }_seconds_max{ labels } { longest }")
+    return "\n".join(lines) + "\n"
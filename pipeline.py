@@ -0,0 +1,63 @@
+import threading
+import logging as log
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Runs tasks on a bounded pool of threads, each task starting once the tasks it depends on are done
+class StagedExecutor():
+    def __init__(self, cfg, workers):
+        self.cfg = cfg
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="stage")
+    
+    # Call a function once all futures are done, right away if there are none
+    @staticmethod
+    def on_done(futures, callback):
+        remaining = [len(futures)]
+        lock = threading.Lock()
+        def done(_):
+            with lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                callback()
+        if not futures:
+            callback()
+        for f in futures:
+            f.add_done_callback(done)
+    
+    # Get a future that is done once all futures are, whether they failed or not
+    def when_done(self, futures) -> Future:
+        result = Future()
+        StagedExecutor.on_done(futures, lambda: result.set_result(None))
+        return result
+    
+    # Run a task once the futures it depends on are done, it is skipped if any of them failed
+    def submit(self, func, *args, after = []) -> Future:
+        result = Future()
+        def start():
+            failed = [f.exception() for f in after if f.exception()]
+            if failed:
+                result.set_exception(failed[0])
+                return
+            self.pool.submit(self.run, func, *args).add_done_callback(lambda f: StagedExecutor.forward(f, result))
+        StagedExecutor.on_done(after, start)
+        return result
+    
+    # Run a task, logging it if it fails
+    def run(self, func, *args):
+        try:
+            return func(*args)
+        except Exception as e:
+            self.cfg.write_log(f"Pipeline: Task { func.__name__ } failed: { repr(e) }", log.error, True)
+            raise
+    
+    # Pass the outcome of one future on to another
+    @staticmethod
+    def forward(source, target):
+        if source.exception():
+            target.set_exception(source.exception())
+        else:
+            target.set_result(source.result())
+    
+    # Stop the worker threads once queued tasks are done
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
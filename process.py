@@ -6,17 +6,30 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'  # FATAL
 logging.getLogger('tensorflow').setLevel(logging.FATAL)
 
 #import tensorflow as tf
-from sklearn.model_selection import train_test_split
-from sklearn.svm import SVC
-from sklearn.multioutput import MultiOutputRegressor
-from sklearn.ensemble import RandomForestClassifier
+# sklearn is only imported when training, as importing it slows down startup
+
+# Split of the training and testing rows of train_svc
+split_params = { "test_size" : 0.2, "random_state" : 42 }
+# Settings the mining models are trained with, models are retrained when these change
+# Every fifth row is held out from training the mining models
+holdout_params = { "every" : 5 }
+mrfc_params = { "random_state" : 42 }
+# Extra settings of each model mode, "separate" trains a forest per output, the others one forest for every output
+mode_params = {
+    "separate" : {},
+    "joint" : {},
+    # Fewer and shallower trees, for smaller files and faster predictions
+    "compact" : { "n_estimators" : 40, "max_depth" : 12, "min_samples_leaf" : 2 }
+}
 
 # Split data into training and testing
 def test_split(features, labels) -> list:
-    return train_test_split(features, labels, test_size=0.2, random_state=42)
+    from sklearn.model_selection import train_test_split
+    return train_test_split(features, labels, **split_params)
 
 # Function to train the classifier
 def train_svc(features, labels):
+    from sklearn.svm import SVC
     # Split data into training and testing sets
     X_train, X_test, y_train, y_test = test_split(features, labels)
     # Initialize and train the classifier (e.g., SVM)
@@ -27,18 +40,57 @@ def train_svc(features, labels):
     # Return trained classifier and accuracy
     return classifier, accuracy
 
-# Function to train the classifier
-def train_mrfc(features, labels):
-    # Split data into training and testing sets
-    X_train, X_test, y_train, y_test = test_split(features, labels)
-    # Initialize and train the classifier (e.g., SVM)
-    classifier = MultiOutputRegressor(RandomForestClassifier(random_state=42))
+# Function to train the classifier, as a forest per output or as one forest for every output depending on the mode
+def train_mrfc(features, labels, n_jobs = None, mode = "separate"):
+    from sklearn.multioutput import MultiOutputRegressor
+    from sklearn.ensemble import RandomForestClassifier
+    # Train on every row but the held out ones and test on those, so grown models are tested on the same unseen rows
+    holdout = holdout_mask(len(features))
+    X_train, X_test, y_train, y_test = features[~holdout], features[holdout], labels[~holdout], labels[holdout]
+    # Initialize and train the classifier
+    classifier = RandomForestClassifier(**mrfc_params, **mode_params[mode], n_jobs=n_jobs)
+    if mode == "separate":
+        classifier = MultiOutputRegressor(classifier)
     classifier.fit(X_train, y_train)
-    # Calculate accuracy
-    accuracy = classifier.score(X_test, y_test)
+    # Calculate accuracy the way MultiOutputRegressor scores, so every mode is compared the same way
+    accuracy = score(classifier, X_test, y_test)
     # Return trained classifier and accuracy
     return classifier, accuracy
 
+# Get the held out rows, the same rows every time, so models trained at different times are compared on the same rows
+def holdout_mask(rows) -> np.ndarray:
+    return np.arange(rows) % holdout_params["every"] == 0
+
+# Score a classifier the same way train_mrfc does
+def score(classifier, features, labels) -> float:
+    from sklearn.metrics import r2_score
+    return r2_score(labels, classifier.predict(features))
+
+# Get the classes of every output of a forest
+def get_classes(forest) -> list:
+    return forest.classes_ if forest.n_outputs_ > 1 else [forest.classes_]
+
+# Train trees on the given rows and add them to a classifier of the same mode, dropping as many of its oldest trees
+# Returns None if the rows do not have the same classes as the classifier, as their trees could not be combined
+def grow_mrfc(classifier, features, labels, trees, seed, n_jobs = None, mode = "separate"):
+    from sklearn.multioutput import MultiOutputRegressor
+    from sklearn.ensemble import RandomForestClassifier
+    params = { **mrfc_params, **mode_params[mode], "n_estimators" : trees, "random_state" : seed }
+    new = RandomForestClassifier(**params, n_jobs=n_jobs)
+    if mode == "separate":
+        new = MultiOutputRegressor(new)
+    new.fit(features, labels)
+    # A forest per output is grown output by output
+    old_forests, new_forests = (classifier.estimators_, new.estimators_) if mode == "separate" else ([classifier], [new])
+    for old, grown in zip(old_forests, new_forests):
+        old_classes, new_classes = get_classes(old), get_classes(grown)
+        if len(old_classes) != len(new_classes) or not all(np.array_equal(a, b) for a, b in zip(old_classes, new_classes)):
+            return None
+    for old, grown in zip(old_forests, new_forests):
+        old.estimators_ = old.estimators_[len(grown.estimators_):] + grown.estimators_
+        old.n_estimators = len(old.estimators_)
+    return classifier
+
 '''
 # Function to train the classifier
 def train_nn(features, labels, epoch_count):
@@ -1,16 +1,51 @@
 import re
 import glob
-import time
+import asyncio
 import numpy as np
 import logging as log
 
 from os import remove
-from os.path import isfile
 from datetime import datetime as date
+from gspread.utils import rowcol_to_a1
 
 import config
+import dataset
+import metrics
+
+# Dates are month/day/year, with two digit years
+date_format = re.compile(r"\d{1,2}/\d{1,2}/\d{2}")
+
+# Split a date into its month, day and two digit year, dates written any other way are parsed with strptime, which fails on them as before
+def split_date(text) -> list:
+    if date_format.fullmatch(text):
+        return text.split('/')
+    return date.strptime(text, '%m/%d/%y').strftime('%m/%d/%y').split('/')
+
+# Turn ragged rows of cell values into a fixed-size array, as trailing empty cells and rows are not returned
+def to_matrix(rows, height, width) -> np.ndarray:
+    matrix = np.full((height, width), '', dtype=object)
+    for r, row in enumerate(rows[:height]):
+        matrix[r, :min(len(row), width)] = row[:width]
+    return np.char.strip(matrix.astype(str))
+
+# Parse the cell values of a block of rows, only keeping rows with both ores and leylines filled in
+def parse_rows(dates, ores, leylines, ore_width = None, leyline_width = None) -> dict:
+    height = len(dates)
+    ores = to_matrix(ores, height, ore_width or max([len(x) for x in ores], default=0))
+    leylines = to_matrix(leylines, height, leyline_width or max([len(x) for x in leylines], default=0))
+    # Shown ores are 1 and hidden ores are 2, anything else is left blank
+    ores = np.where(ores == '1', 1, np.where(ores == '2', 2, 0))
+    y = leylines == 'y'
+    b = leylines == 'b'
+    rows = np.flatnonzero((ores == 1).any(axis=1) & y.any(axis=1) & b.any(axis=1))
+    d = np.array([split_date(dates[r]) for r in rows], dtype=int).reshape(-1, 3)
+    d = np.stack([np.where(d[:, 2] < 69, 2000, 1900) + d[:, 2], d[:, 0], d[:, 1]], axis=1)
+    return { "rows" : rows, "d" : d, "ores" : ores[rows], "y" : y[rows].argmax(axis=1), "b" : b[rows].argmax(axis=1) }
 
 class DataRetriever():
+    # First row of nation data in the "<Nation> Data" sheets
+    first_row = 3
+    
     def __init__(self, cfg:config.cfg):
         self.cfg = cfg
         
@@ -18,81 +53,138 @@ class DataRetriever():
         self.read_data()
     
     def read_data(self):
+        if self.cfg.force_data_reset:
+            self.cfg.write_log("Data: Force reset initiated...", log.warning, True)
+            files = glob.glob(self.cfg.data_prefix + "*")
+            for f in files:
+                remove(f)
+            self.cfg.write("force_data_reset", False)
+            self.cfg.force_data_reset = False
+        else:
+            # Data from before the consolidated store is retrieved again
+            files = glob.glob(self.cfg.data_prefix + "*.npy")
+            if files:
+                self.cfg.write_log("Data: Removing old .npy data files...", log.warning, True)
+            for f in files:
+                remove(f)
         
-        self.ex_data = []
-        self.cfg.write_log("Data: Force reset initiated...", log.warning, True)
-        self.ex_data = [{ k : [] for k in self.cfg.suffix_names.keys() } for _ in self.cfg.nations]
-        
-        files = glob.glob(self.cfg.data_prefix + "*")
-        for f in files:
-            remove(f)
-
-        self.cfg.write("force_data_reset", False)
+        self.cfg.write_log("Data: Reading stored data...", log.info)
+        self.data = [dataset.MiningDataset(self.cfg.data_prefix, n) for n in self.cfg.nations]
     
-    def retrieve_mining_data(self):
+    # Retrieve the new rows of every nation, returning whether every nation was retrieved
+    def retrieve_mining_data(self) -> bool:
         self.cfg.write_log("Data: Constructing nation data...", log.info)
-        for i, n in enumerate(self.cfg.nations):
-                
-            # Open the Google Sheets document
-            sheet = self.cfg.ws.worksheet(n + " Data")
-            
-            # Find column for leyline beginnings
-            leyline_col = sheet.find("Leyline Positions", 1).col
-            # Find column for end of sheet data
-            end_col = sheet.find("2", 1).col
-            # Get all image URLs
-            data_amount = sheet.find(date.today().strftime("%m/%d/%y"), in_column=1).row - 3
-            # Check if current data is sufficent
-            current_amount = len(self.ex_data[i]["d"])
-            if data_amount == current_amount:
-                self.cfg.write_log(f"Data: [{n}] Looks done already.", log.info)
-                continue
-            self.cfg.write_log(f"Data: [{n}] Starting data retrieval...", log.info)
-            
-            # Get all date data
-            dates = sheet.col_values(1)[2 + current_amount:3 + data_amount]
-            dates = [date.strptime(d, '%m/%d/%y') for d in dates]
-            self.ex_data[i]["d"].extend([[d.year, d.month, d.day] for d in dates])
-            
-            # Get all ore data
-            ore_data = sheet.range(3 + current_amount, 2, 3 + data_amount, leyline_col - 1)
-            # Split range data by row
-            ores = [ore_data[i:i + leyline_col - 2] for i in range(0, len(ore_data), leyline_col - 2)]
-            # Get cell values instead of Cell objects
-            ores = [[(int(x.value) if re.search('[0-9]', x.value) else '') for x in y] for y in ores]
-            # Trim to only indices, remove blanks
-            ores = [[[i for i, y in enumerate(x) if y == 1], [i for i, y in enumerate(x) if y == 2]] for x in ores if 1 in x]
-            self.ex_data[i]['1'].extend([x[0] for x in ores])
-            self.ex_data[i]['2'].extend([x[1] for x in ores])
-            
-            # Get all labels [[y,b], [y,b], ...]
-            label_data = sheet.range(3 + current_amount, leyline_col, 3 + data_amount, end_col - 1)
-            # Split range data by row
-            leylines = [label_data[i:i + end_col - leyline_col] for i in range(0, len(label_data), end_col - leyline_col)]
-            # Get cell values instead of Cell objects
-            leylines = [[x.value for x in y] for y in leylines]
-            # Trim to only indices, remove blanks
-            leylines = [[x.index('y'), x.index('b')] for x in leylines if 'y' in x]
-            self.ex_data[i]['y'].extend([x[0] for x in leylines])
-            self.ex_data[i]['b'].extend([x[1] for x in leylines])
-
-            self.cfg.write_log(f"Data: [{n}] Storing normal info...", log.info)
-
-            # Save features and labels to .npy files
-            for l in self.cfg.suffix_names.keys():
-                if l != 'f':
-                    np.save(self.cfg.data_prefix + n.lower() + self.cfg.suffix[l] + ".npy", np.array(self.ex_data[i][l]))
-                
-            self.cfg.write_log(f"Data: [{n}] Data retrieved.", log.info)
-            self.cfg.write_log(f"Data: [{n}] Waiting for cooldown...", log.info)
-            time.sleep(15)
+        skipped = asyncio.run(self.retrieve_all())
             
+        self.cfg.write_log(f"Data: Sheets usage: { self.cfg.sheets.summary() }", log.info, True)
+        # Skipped nations are retrieved again on the next run, instead of after the configured amount of days
+        if skipped:
+            self.cfg.write_log(f"Data: Partly retrieved, { ', '.join(skipped) } skipped, not updating timestamp...", log.warning, True)
+            return False
         self.cfg.write_log("Data: Updating timestamp...", log.info, True)
 
         # Write the timestamp for when data was updated
         self.cfg.write_model("Data", date.now().timestamp())
             
         self.cfg.write_log("Data: Labels saved successfully.", log.info, True)
+        return True
+    
+    # Make a Sheets request on a worker thread, so other nations go on while it waits
+    async def call(self, f, name):
+        return await asyncio.to_thread(self.cfg.sheets.call, f, name)
+    
+    # Retrieve the nations at the same time, the Sheets client keeps the requests within the quota
+    # Returns the nations that were skipped
+    async def retrieve_all(self) -> list:
+        # Open every worksheet with a single request
+        sheets = { s.title : s for s in await self.call(lambda: self.cfg.ws.worksheets(), "worksheets") }
+        semaphore = asyncio.Semaphore(self.cfg.sheets_concurrency)
+        done = []
+        skipped = []
+        
+        async def retrieve(i, n):
+            async with semaphore:
+                if not await self.retrieve_nation(i, n, sheets[n + " Data"]):
+                    skipped.append(n)
+            done.append(n)
+            self.cfg.write_log(f"Data: [{n}] Done ({ len(done) }/{ len(self.cfg.nations) })", log.info)
+        
+        # Let every nation finish before failing, so the ones that worked are kept
+        results = await asyncio.gather(*[retrieve(i, n) for i, n in enumerate(self.cfg.nations)], return_exceptions=True)
+        errors = [(n, e) for n, e in zip(self.cfg.nations, results) if isinstance(e, Exception)]
+        for n, e in errors:
+            self.cfg.write_log(f"Data: [{n}] Retrieval failed: { repr(e) }", log.error, True)
+        if errors:
+            raise errors[0][1]
+        return skipped
+    
+    # Retrieve the new rows of a nation, returning whether it was retrieved or skipped
+    async def retrieve_nation(self, i, n, sheet) -> bool:
+        data = self.data[i]
+        
+        # Get all dates, used to find the current row and to check the stored data, along with the header
+        dates, header = await asyncio.gather(
+            self.call(lambda: sheet.col_values(1), "col_values"),
+            self.call(lambda: sheet.row_values(1), "row_values"))
+        today = date.today().strftime("%m/%d/%y")
+        if today not in dates:
+            self.cfg.write_log(f"Data: [{n}] No row for { today }, skipping...", log.warning, True)
+            return False
+        end_row = dates.index(today) + 1
+        # Check that the stored data still lines up with the sheet
+        last_row = data.meta["last_row"]
+        if data.rows and (len(dates) < last_row or dates[last_row - 1] != data.meta["last_date"]):
+            self.cfg.write_log(f"Data: [{n}] Stored data does not match the sheet, retrieving all rows...", log.warning, True)
+            data.reset()
+        # Check if current data is sufficent
+        start_row = max(data.meta["last_row"] + 1, DataRetriever.first_row)
+        if start_row > end_row:
+            self.cfg.write_log(f"Data: [{n}] Looks done already.", log.info)
+            return True
+        self.cfg.write_log(f"Data: [{n}] Retrieving rows {start_row} to {end_row}...", log.info)
+        
+        # Find column for leyline beginnings
+        leyline_col = header.index("Leyline Positions") + 1
+        # Find column for end of sheet data
+        end_col = header.index("2") + 1
+        
+        # Get all ore and label data as raw values, in a single request
+        ranges = [
+            rowcol_to_a1(start_row, 2) + ":" + rowcol_to_a1(end_row, leyline_col - 1),
+            rowcol_to_a1(start_row, leyline_col) + ":" + rowcol_to_a1(end_row, end_col - 1)
+        ]
+        ores, leylines = await self.call(lambda: sheet.batch_get(ranges), "batch_get")
+        
+        # Only keep complete rows, so every stored column stays aligned
+        rows = await asyncio.to_thread(self.parse_nation, n, dates[start_row - 1:end_row], ores, leylines, leyline_col - 2, end_col - leyline_col)
+        # Only the complete rows before the first incomplete one are stored, so rows filled in later are retrieved next time
+        gaps = np.flatnonzero(rows["rows"] != np.arange(len(rows["rows"])))
+        if gaps.size:
+            self.cfg.write_log(f"Data: [{n}] Row { start_row + int(gaps[0]) } is not complete, stopping there...", log.info)
+            rows = { k : v[:gaps[0]] for k, v in rows.items() }
+        if len(rows["rows"]) == 0:
+            self.cfg.write_log(f"Data: [{n}] No complete rows yet.", log.info)
+            return True
+
+        self.cfg.write_log(f"Data: [{n}] Storing normal info...", log.info)
+        
+        # Save the rows along with where they leave off in the sheet
+        last_row = start_row + int(rows["rows"][-1])
+        await asyncio.to_thread(self.store_nation, n, data, rows, last_row, dates[last_row - 1], end_col - leyline_col)
+            
+        self.cfg.write_log(f"Data: [{n}] Data retrieved.", log.info)
+        return True
+    
+    # Parse the rows of a nation, off the event loop
+    def parse_nation(self, n, *args) -> dict:
+        with metrics.timer("data.parse", nation=n):
+            return parse_rows(*args)
+    
+    # Store the rows of a nation, off the event loop
+    def store_nation(self, n, data, rows, last_row, last_date, leylines):
+        with metrics.timer("data.store", nation=n):
+            data.append(rows["d"], rows["ores"], rows["y"], rows["b"], last_row, last_date, leylines)
+        metrics.count("data.rows", len(rows["rows"]), nation=n)
 
 # Main function
 def main():
@@ -0,0 +1,198 @@
+import sys
+import json
+import time
+import threading
+import numpy as np
+import logging as log
+
+from os.path import isfile
+from concurrent.futures import Future
+from datetime import datetime as date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cache
+import train
+import config
+import dataset
+import metrics
+
+# A nation or model that does not exist, answered with 404
+class NotFoundError(Exception):
+    pass
+
+# Serves mining predictions over local HTTP, keeping every nation's model loaded between requests
+class PredictionService():
+    def __init__(self, cfg:config.cfg) -> None:
+        self.cfg = cfg
+        self.started = time.time()
+        self.lock = threading.Lock()
+        # Predictions that are being made, so identical requests wait for the first one instead of predicting again
+        self.pending = {}
+        self.cache = cache.PredictionCache(cfg)
+        self.models = {}
+        # The amount of ores and leylines in each nation's data, kept with its model
+        self.limits = {}
+        # Each nation is loaded under its own lock, so reloading one does not hold up requests for the others
+        self.load_locks = { n : threading.Lock() for n in cfg.nations }
+        for n in cfg.nations:
+            if isfile(train.model_file(cfg.model_prefix, n)):
+                self.models[n] = self.load(n)
+            else:
+                cfg.write_log(f"Service: [{ n }] No model, it can not be predicted until it is trained", log.warning, True)
+
+    # Load a nation's model now, so the first request does not have to, along with the limits of its data
+    def load(self, nation) -> train.MiningTrainer:
+        model = train.MiningTrainer(nation, False, self.cfg, self.cache)
+        model.classifier
+        data = dataset.MiningDataset(self.cfg.data_prefix, nation)
+        leylines = data.meta.get("leylines", 0)
+        # Data stored before the amount of leylines was kept only has the positions found in it
+        if not leylines and data.rows:
+            leylines = int(np.asarray(data.load()[:, [data.columns["y"], data.columns["b"]]]).max()) + 1
+        self.limits[nation] = (data.meta["ores"], leylines)
+        return model
+
+    # Get a nation's model, loading it again if it was retrained since it was loaded
+    def get_model(self, nation) -> train.MiningTrainer:
+        if nation not in self.cfg.nations:
+            raise NotFoundError(f"Unknown nation \"{ nation }\"")
+        if not isfile(train.model_file(self.cfg.model_prefix, nation)):
+            raise NotFoundError(f"No model for { nation }")
+        with self.load_locks[nation]:
+            if nation not in self.models or self.models[nation].version != train.model_version(self.cfg, nation):
+                self.cfg.write_log(f"Service: [{ nation }] Model changed, loading it again...", log.info, True)
+                self.models[nation] = self.load(nation)
+            return self.models[nation]
+
+    # Get a (nation, date, shown ores, leylines) record from a request, the date is today if not given
+    def get_record(self, body) -> tuple:
+        try:
+            record = (str(body["nation"]), [int(x) for x in body.get("date") or PredictionService.get_date()],
+                      [int(x) for x in body["ore_shown"]], [int(x) for x in body["leylines"]])
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Invalid record { json.dumps(body) }: { repr(e) }")
+        if len(record[1]) != 3 or len(record[3]) != 2:
+            raise ValueError(f"Invalid record { json.dumps(body) }: date has to be [year, month, day] and leylines [y, b]")
+        # Rows with fewer shown ores than the model takes are padded like the rows it was trained on, but not with more
+        shown = self.get_model(record[0]).shown
+        ores, leylines = self.limits[record[0]]
+        if not 0 < len(record[2]) <= shown or len(set(record[2])) != len(record[2]) or not all(0 <= x < ores for x in record[2]):
+            raise ValueError(f"Invalid record { json.dumps(body) }: { record[0] } takes 1 to { shown } different shown ores from 0 to { ores - 1 }")
+        if record[3][0] == record[3][1] or not all(0 <= x < leylines for x in record[3]):
+            raise ValueError(f"Invalid record { json.dumps(body) }: { record[0] } takes two different leylines from 0 to { leylines - 1 }")
+        return record
+
+    @staticmethod
+    def get_date() -> list:
+        today = date.today()
+        return [today.year, today.month, today.day]
+
+    # Predict a list of records, calling each nation's model once
+    def predict(self, records) -> list:
+        models = { r[0] : self.get_model(r[0]) for r in records }
+        labels, confidence = train.predict_records(models, records)
+        return [{ "nation" : r[0], "ore_hidden" : l.tolist(), "confidence" : c.tolist() } for r, l, c in zip(records, labels, confidence)]
+
+    # Run a request, unless an identical one is already running, in which case its result is shared
+    def coalesce(self, key, f):
+        with self.lock:
+            future = self.pending.get(key)
+            first = future is None
+            if first:
+                future = self.pending[key] = Future()
+        if not first:
+            metrics.count("service.coalesced")
+            return future.result()
+        try:
+            result = f()
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.pending[key]
+
+    def predict_one(self, body) -> dict:
+        record = self.get_record(body)
+        return self.coalesce(json.dumps(record), lambda: self.predict([record])[0])
+
+    def predict_batch(self, body) -> dict:
+        if not isinstance(body, dict) or not isinstance(body.get("records"), list):
+            raise ValueError("Expected { \"records\" : [...] }")
+        records = [self.get_record(r) for r in body["records"]]
+        return { "results" : self.coalesce(json.dumps(records), lambda: self.predict(records)) }
+
+    def get_health(self) -> dict:
+        return { "nations" : sorted(self.models), "uptime_s" : time.time() - self.started }
+
+    def get_stats(self) -> dict:
+        return { "uptime_s" : time.time() - self.started, **metrics.summary() }
+
+# Handles each request on its own thread, the routes map a method and path to a function of the request body
+class RequestHandler(BaseHTTPRequestHandler):
+    routes = {
+        ("GET", "/health") : lambda service, body: service.get_health(),
+        ("GET", "/stats") : lambda service, body: service.get_stats(),
+        ("POST", "/predict") : lambda service, body: service.predict_one(body),
+        ("POST", "/predict/batch") : lambda service, body: service.predict_batch(body)
+    }
+
+    def do_GET(self):
+        self.handle_route("GET")
+
+    def do_POST(self):
+        self.handle_route("POST")
+
+    def handle_route(self, method):
+        service = self.server.service
+        path = self.path.split("?")[0].rstrip("/")
+        route = RequestHandler.routes.get((method, path))
+        if route is None:
+            self.respond(404, { "error" : f"No route { method } { path }" })
+            return
+        with metrics.timer("service.request", endpoint=path):
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                self.respond(200, route(service, body))
+            except NotFoundError as e:
+                self.respond(404, { "error" : str(e) })
+            except ValueError as e:
+                self.respond(400, { "error" : str(e) })
+            except Exception as e:
+                service.cfg.write_log(f"Service: { method } { path } failed: { repr(e) }", log.error, True)
+                self.respond(500, { "error" : repr(e) })
+
+    def respond(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        metrics.count("service.responses", endpoint=self.path.split("?")[0].rstrip("/"), status=status)
+
+    # Log requests like the rest of the program, instead of to stderr
+    def log_message(self, format, *args):
+        self.server.service.cfg.write_log("Service: " + format % args, log.debug)
+
+def main() -> int:
+    # The service only reads the stored models, so it does not connect to the sheet
+    cfg = config.cfg(connect=False)
+    service = PredictionService(cfg)
+    server = ThreadingHTTPServer((cfg.service["host"], cfg.service["port"]), RequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    cfg.write_log(f"Service: Serving { len(service.models) } models on http://{ cfg.service['host'] }:{ cfg.service['port'] }", log.info, True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        cfg.write_log("Service: Stopped.", log.info, True)
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import time
+import random
+import threading
+import logging as log
+
+from collections import deque
+from gspread.exceptions import APIError
+
+import metrics
+
+# Sliding window over the last minute, sending as fast as the per-minute quota of the Sheets API allows but never more in any minute
+class RateLimiter():
+    window = 60
+    
+    def __init__(self, per_minute):
+        if not isinstance(per_minute, int) or per_minute < 1:
+            raise ValueError(f"The requests per minute have to be a whole number of at least 1, not { per_minute }")
+        self.per_minute = per_minute
+        # When each request in the window was sent, oldest first
+        self.sent = deque()
+        self.lock = threading.Lock()
+    
+    # Wait until a request may be sent, return the time spent waiting
+    def acquire(self) -> float:
+        waited = 0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.sent and now - self.sent[0] >= RateLimiter.window:
+                    self.sent.popleft()
+                if len(self.sent) < self.per_minute:
+                    self.sent.append(now)
+                    return waited
+                # Wait for the oldest request to leave the window
+                delay = self.sent[0] + RateLimiter.window - now
+            time.sleep(delay)
+            waited += delay
+
+# Shared access point for every Google Sheets request
+class SheetsClient():
+    def __init__(self, cfg):
+        self.cfg = cfg
+        if cfg.sheets_max_retries < 0 or cfg.sheets_backoff_base < 0 or cfg.sheets_backoff_max < cfg.sheets_backoff_base:
+            raise ValueError("The Sheets retries and backoff can not be negative, and the maximum backoff can not be below the base")
+        self.limiter = RateLimiter(cfg.sheets_quota)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.wait_time = 0
+    
+    # Get the HTTP status of a failed request
+    @staticmethod
+    def get_status(error: APIError) -> int:
+        return getattr(getattr(error, "response", None), "status_code", 0) or 0
+    
+    # Only running out of quota and server side errors are worth retrying
+    @staticmethod
+    def is_retryable(error: APIError) -> bool:
+        status = SheetsClient.get_status(error)
+        return status == 429 or status >= 500
+    
+    # Add to the request statistics
+    def count(self, calls = 0, retries = 0, wait_time = 0):
+        with self.lock:
+            self.calls += calls
+            self.retries += retries
+            self.wait_time += wait_time
+    
+    # Run a single request, retrying with exponential backoff on quota and server errors
+    def call(self, f, name = "request"):
+        attempt = 0
+        while True:
+            waited = self.limiter.acquire()
+            self.count(calls=1, wait_time=waited)
+            metrics.add_time("sheets.limiter_wait", waited)
+            metrics.count("sheets.calls", request=name)
+            try:
+                with metrics.timer("sheets.request", request=name):
+                    return f()
+            except APIError as e:
+                if not SheetsClient.is_retryable(e) or attempt >= self.cfg.sheets_max_retries:
+                    raise
+                # Back off exponentially, with jitter so threads do not retry in lockstep
+                delay = min(self.cfg.sheets_backoff_max, self.cfg.sheets_backoff_base * 2 ** attempt)
+                delay = delay / 2 + random.uniform(0, delay / 2)
+                self.cfg.write_log(f"Sheets: Request failed with status { SheetsClient.get_status(e) }, retrying in { delay:.1f}s...", log.warning)
+                time.sleep(delay)
+                self.count(retries=1, wait_time=delay)
+                metrics.add_time("sheets.backoff", delay, request=name)
+                attempt += 1
+    
+    # Summarize the requests made so far
+    def summary(self) -> str:
+        with self.lock:
+            return f"{ self.calls } requests, { self.retries } retries, { self.wait_time:.1f}s waiting"
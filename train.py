@@ -1,11 +1,20 @@
+import os
+import json
+import time
+import hashlib
+import threading
 import numpy as np
 import logging as log
 
 from os.path import isfile
 from joblib import dump, load
 from datetime import datetime as date
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import config
+import forest
+import dataset
+import metrics
 import process
 
 class Trainer():
@@ -23,10 +32,9 @@ class Trainer():
                 self.model[c][attributes[0]][n] = isfile(self.cfg.model_prefix + n.lower() + "_" + c + ".joblib")
                 self.model[c][attributes[1]][n] = self.cfg.accuracy[c][n] or -1
         self.force_reset = do_reset
-        self.confidence = 0
     
     def predict(self, features):
-        return None
+        return None, None
     
     # Update timestamp for config
     def update_timestamp(self, nation, suffix):
@@ -37,42 +45,304 @@ class Trainer():
         self.cfg.write_model(nation + suffix + "_accuracy", accuracy)
 
 class MiningTrainer(Trainer):
-    def __init__(self, nation, do_reset, cfg):
+    def __init__(self, nation, do_reset, cfg, cache = None):
         super().__init__(do_reset, cfg)
         
+        self.nation = nation
         self.mining = self.model["mining"]
+        self.loaded_classifier = None
+        self.load_lock = threading.Lock()
+        self.cache = cache
         
-        if self.mining["file"][nation] and not self.force_reset:
-            self.cfg.write_log(f"Mining: [{ nation }] Loading existing model...", log.info)
-            self.classifier = load(self.cfg.model_prefix + nation + "_mining.joblib")
+        if self.force_reset:
+            self.cfg.write_log(f"Mining: [{ nation }] Old mining model out of date, training new model...", log.warning, False)
+            self.accuracy = train_mining_models([nation], self.cfg, True).get(nation, -1)
+        elif self.has_model:
+            # The model itself is only loaded once it is needed
             self.accuracy = self.mining["accuracy"][nation]
         else:
-            self.cfg.write_log(f"Mining: [{ nation }] Old mining model out of date, training new model...", log.warning, False)
-            self.list_order = ['d', '1', 'y', 'b']
-            lists = { k : np.load(self.cfg.data_prefix + nation.lower() + self.cfg.suffix[k] + ".npy") for k in self.list_order }
-            feature = np.concatenate([
-                lists['d'], 
-                lists['1'], 
-                lists['y'].reshape(-1, 1), 
-                lists['b'].reshape(-1, 1)
-                ], axis=1)
-            self.cfg.write_log(f"Mining: [{ nation }] Loaded data...", log.info)
-            labels = np.load(self.cfg.data_prefix + nation.lower() + self.cfg.suffix['2'] + ".npy")
-            self.cfg.write_log(f"Mining: [{ nation }] Loaded results...", log.info)
-            
-            self.cfg.write_log(f"Mining: [{ nation }] Training...", log.info)
-            self.classifier, self.accuracy = process.train_mrfc(feature, labels)
-            self.cfg.write_log(f"Mining: [{ nation }] Training complete", log.info)
-                
-            dump(self.classifier, self.cfg.model_prefix + nation.lower() + "_mining.joblib")
-            self.update_accuracy(nation, "_mining", self.accuracy)
-        self.cfg.write_log("Mining: [" + nation + "] Loaded Mining AI with {0:.2%} accuracy.".format(self.accuracy), log.info)
-
-    # Function to predict Leyline location in a given screenshot
+            # Models are trained before their trainers are made, so a nation still without one had nothing to train on
+            self.cfg.write_log(f"Mining: [{ nation }] No model, it can not be predicted until it is trained", log.warning, True)
+            self.accuracy = -1
+        if self.has_model:
+            self.cfg.write_log("Mining: [" + nation + "] Found Mining AI with {0:.2%} accuracy.".format(self.accuracy), log.info)
+        self.update_version()
+    
+    # Whether the nation has a stored model to predict with
+    @property
+    def has_model(self) -> bool:
+        return isfile(model_file(self.cfg.model_prefix, self.nation))
+    
+    # Identify the model in use, dropping cached predictions of any other model
+    def update_version(self):
+        self.version = model_version(self.cfg, self.nation)
+        if self.cache is not None:
+            dropped = self.cache.invalidate(self.nation, self.version)
+            if dropped:
+                self.cfg.write_log(f"Mining: [{ self.nation }] Dropped { dropped } cached predictions of an older model", log.info)
+    
+    # Get the classifier, loading it the first time it is used
+    @property
+    def classifier(self):
+        with self.load_lock:
+            if self.loaded_classifier is None:
+                self.cfg.write_log(f"Mining: [{ self.nation }] Loading existing model...", log.info)
+                start = time.perf_counter()
+                path = model_file(self.cfg.model_prefix, self.nation)
+                # Memory-map the compiled model if it is up to date, instead of reading it all in
+                with metrics.timer("model.load", nation=self.nation):
+                    source = forest.get_source(path)
+                    self.loaded_classifier = forest.CompiledForest.load(forest.forest_dir(self.cfg.model_prefix, self.nation, source), source)
+                    if self.loaded_classifier is None:
+                        self.cfg.write_log(f"Mining: [{ self.nation }] No compiled model, loading it with sklearn...", log.info)
+                        # Read in full, as the model file is replaced when retraining, which fails on Windows while it is mapped
+                        self.loaded_classifier = load(path)
+                # The model may have been replaced since this trainer was made
+                self.update_version()
+                self.cfg.write_log(f"Mining: [{ self.nation }] Loaded model in { time.perf_counter() - start:.2f}s", log.info)
+            return self.loaded_classifier
+
+    # Amount of shown ores the model takes, the rest of its features are the date and both leylines
+    @property
+    def shown(self) -> int:
+        return get_n_features(self.classifier) - 5
+    
+    # Build a feature vector of a row for the model, in the layout of the rows it was trained on
+    def get_features(self, date, ore_shown, leylines) -> list:
+        return mining_features(date, ore_shown, leylines, self.shown)
+    
+    # Predict the hidden ores, along with the confidence of each one
     def predict(self, features):
-        # Use the trained classifier to predict the Leyline location
-        predicted_location = self.classifier.predict(np.array(features).reshape(1,-1))[0]
-        # Update the confidence of the prediction
-        self.confidence = np.average(np.array([np.max(estimator.predict_proba(np.array(features).reshape(1,-1)), axis=1) for estimator in self.classifier.estimators_]).T, axis=1)[0]
+        labels, confidence = self.predict_batch(np.array(features).reshape(1, -1))
         # Return the predicted location
-        return predicted_location
\ No newline at end of file
+        return labels[0], confidence[0]
+    
+    # Predict the hidden ores of every row in a 2-D feature matrix, only running the model for rows not cached
+    def predict_batch(self, features):
+        features = np.atleast_2d(features)
+        if self.cache is None:
+            return self.predict_uncached(features)
+        
+        keys = [self.cache.get_key(self.nation, self.version, row) for row in features]
+        results = [self.cache.get(k) for k in keys]
+        missing = [i for i, r in enumerate(results) if r is None]
+        metrics.count("predict.cache_hits", len(keys) - len(missing), nation=self.nation)
+        if missing:
+            labels, confidence = self.predict_uncached(features[missing])
+            # Loading the model may have changed its version, so the keys are made again
+            for j, i in enumerate(missing):
+                results[i] = (labels[j], confidence[j])
+                self.cache.put(self.cache.get_key(self.nation, self.version, features[i]), labels[j], confidence[j])
+        return np.stack([r[0] for r in results]), np.stack([r[1] for r in results])
+    
+    # Predict the hidden ores of every row in a 2-D feature matrix with the model
+    def predict_uncached(self, features):
+        classifier = self.classifier
+        with metrics.timer("predict", nation=self.nation):
+            labels, confidence = predict_classifier(classifier, features)
+        metrics.count("predict.rows", len(labels), nation=self.nation)
+        return labels, confidence
+
+# Get the file a nation's mining model is stored in
+def model_file(model_prefix, nation) -> str:
+    return model_prefix + nation.lower() + "_mining.joblib"
+
+# Identify a nation's stored model by what it was trained from and when it was written
+def model_version(cfg, nation) -> str:
+    path = model_file(cfg.model_prefix, nation)
+    written = os.stat(path).st_mtime_ns if isfile(path) else 0
+    return hashlib.sha1(f"{ cfg.model_data.get(nation + '_mining_fingerprint', '') }:{ written }".encode()).hexdigest()[:16]
+
+# Load the features and labels of a nation from the stored data
+def load_mining_data(nation, data_prefix):
+    data = dataset.MiningDataset(data_prefix, nation)
+    return data.features(), data.labels()
+
+# Train a nation's mining model and store it, returning its accuracy
+def train_mining_model(nation, data_prefix, model_prefix, n_jobs, mode = "separate"):
+    with metrics.timer("train.load_data", nation=nation):
+        feature, labels = load_mining_data(nation, data_prefix)
+    with metrics.timer("train.fit", nation=nation):
+        classifier, accuracy = process.train_mrfc(feature, labels, n_jobs, mode)
+    store_mining_model(classifier, nation, model_prefix)
+    return accuracy
+
+# Grow a nation's stored mining model with trees trained on its latest rows, returning its accuracy on the holdout rows
+# Returns None if the model could not be grown or got worse, so it has to be trained again in full
+def update_mining_model(nation, data_prefix, model_prefix, n_jobs, mode, window, trees, max_drop):
+    with metrics.timer("train.load_data", nation=nation):
+        features, labels = load_mining_data(nation, data_prefix)
+        classifier = load(model_file(model_prefix, nation))
+    holdout = process.holdout_mask(len(features))
+    # Only the latest rows that are not held out are trained on, so the cost does not grow with the history
+    recent = np.flatnonzero(~holdout)[-window:]
+    with metrics.timer("train.grow", nation=nation):
+        before = process.score(classifier, features[holdout], labels[holdout])
+        classifier = process.grow_mrfc(classifier, features[recent], labels[recent], trees, len(features), n_jobs, mode)
+        if classifier is None:
+            return None
+        accuracy = process.score(classifier, features[holdout], labels[holdout])
+    if not accuracy >= before - max_drop:
+        return None
+    store_mining_model(classifier, nation, model_prefix)
+    return accuracy
+
+# Store a nation's mining model, along with its compiled export
+def store_mining_model(classifier, nation, model_prefix):
+    # Dump to a temporary file first, so an interrupted dump never replaces a working model
+    path = model_file(model_prefix, nation)
+    with metrics.timer("model.dump", nation=nation):
+        dump(classifier, path + ".tmp")
+        os.replace(path + ".tmp", path)
+    # Export the trees for predicting without sklearn, marked with the model file they were made from
+    with metrics.timer("model.compile", nation=nation):
+        source = forest.get_source(path)
+        forest.CompiledForest.compile(classifier, source).save(forest.forest_dir(model_prefix, nation, source))
+        forest.remove_stale(model_prefix, nation, source)
+
+# Grow a nation's mining model if given how, falling back to training it in full, returning its accuracy and whether it was grown
+def fit_mining_model(nation, data_prefix, model_prefix, n_jobs, mode, update):
+    if update is not None:
+        accuracy = update_mining_model(nation, data_prefix, model_prefix, n_jobs, mode, **update)
+        if accuracy is not None:
+            return accuracy, True
+    return train_mining_model(nation, data_prefix, model_prefix, n_jobs, mode), False
+
+# Fit a nation's mining model in a worker process, returning its accuracy, whether it was grown and what was measured
+def train_mining_worker(nation, data_prefix, model_prefix, n_jobs, mode, update):
+    metrics.reset()
+    accuracy, grown = fit_mining_model(nation, data_prefix, model_prefix, n_jobs, mode, update)
+    return accuracy, grown, metrics.snapshot()
+
+# Get the model mode of a nation, nations without one use the default
+def get_model_mode(cfg, nation) -> str:
+    return cfg.model_modes.get(nation, cfg.model_modes["default"])
+
+# Settings a nation's model is trained with
+def get_settings(cfg, nation) -> dict:
+    mode = get_model_mode(cfg, nation)
+    return { "split" : process.holdout_params, "model" : process.mrfc_params, "mode" : mode, "mode_params" : process.mode_params[mode] }
+
+# Hash a value that can be written as JSON
+def get_hash(value) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+# Fingerprint of what a nation's model is trained from, its data and the training settings
+def get_fingerprint(cfg, nation) -> str:
+    return get_hash({ "data" : dataset.MiningDataset(cfg.data_prefix, nation).fingerprint, **get_settings(cfg, nation) })
+
+# Get how a nation's model can be grown with its new rows, or None if it has to be trained in full
+# It is trained in full if its data was reset or changed layout, its settings changed, or it was grown too many times already
+def get_update(cfg, nation):
+    incremental = cfg.incremental_training
+    data = dataset.MiningDataset(cfg.data_prefix, nation)
+    trained = lambda key, default = None: cfg.model_data.get(nation + "_mining_" + key, default)
+    if not incremental["enabled"] or not isfile(model_file(cfg.model_prefix, nation)):
+        return None
+    if trained("generation") != data.meta["generation"] or trained("features") != data.columns["ore2"].start or trained("settings") != get_hash(get_settings(cfg, nation)):
+        return None
+    if trained("updates", 0) >= incremental["full_every"] or data.rows <= trained("rows", 0):
+        return None
+    return { "window" : incremental["window"], "trees" : incremental["trees"], "max_drop" : incremental["max_accuracy_drop"] }
+
+# Get the nations whose model is missing or was trained from different data or settings
+def get_outdated(cfg) -> list:
+    return [n for n in cfg.nations if not isfile(model_file(cfg.model_prefix, n)) or get_fingerprint(cfg, n) != cfg.model_data.get(n + "_mining_fingerprint")]
+
+# Get the amount of cores that training may use
+def get_cpu_budget(cfg) -> int:
+    return 1 if cfg.arg.singlethread else (cfg.cpu_budget or os.cpu_count() or 1)
+
+# Train the mining models of several nations at once, splitting the cores between nations and trees
+# Models are grown with their new rows where possible, unless full is given
+def train_mining_models(nations, cfg, full = False):
+    # Nations without any stored rows cannot be trained
+    for n in [n for n in nations if dataset.MiningDataset(cfg.data_prefix, n).rows == 0]:
+        cfg.write_log(f"Mining: [{ n }] No data to train on, skipping...", log.warning, True)
+        nations = [x for x in nations if x != n]
+    budget = get_cpu_budget(cfg)
+    workers = max(1, min(len(nations), budget))
+    n_jobs = max(1, budget // workers)
+    # Fingerprint the data before training, so rows added meanwhile cause another retrain
+    fingerprints = { n : get_fingerprint(cfg, n) for n in nations }
+    data = { n : dataset.MiningDataset(cfg.data_prefix, n) for n in nations }
+    updates = { n : None if full else get_update(cfg, n) for n in nations }
+    cfg.write_log(f"Mining: Training { len(nations) } models with { workers } processes of { n_jobs } cores...", log.info)
+    
+    accuracy = {}
+    grown = {}
+    def done(n):
+        cfg.write_log(f"Mining: [{ n }] " + ("Grown with new rows" if grown[n] else "Training complete" if updates[n] is None else "Could not be grown, trained in full"), log.info)
+    if workers == 1:
+        for n in nations:
+            accuracy[n], grown[n] = fit_mining_model(n, cfg.data_prefix, cfg.model_prefix, n_jobs, get_model_mode(cfg, n), updates[n])
+            done(n)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = { pool.submit(train_mining_worker, n, cfg.data_prefix, cfg.model_prefix, n_jobs, get_model_mode(cfg, n), updates[n]) : n for n in nations }
+            for f in as_completed(futures):
+                accuracy[futures[f]], grown[futures[f]], measured = f.result()
+                metrics.merge(measured)
+                done(futures[f])
+    
+    # Only this process writes the model config, so results from workers cannot clobber each other
+    for n, a in accuracy.items():
+        cfg.write_models({
+            n + "_mining_accuracy" : a,
+            n + "_mining_fingerprint" : fingerprints[n],
+            # What the model was trained from, to tell whether it can be grown next time
+            n + "_mining_rows" : data[n].rows,
+            n + "_mining_generation" : data[n].meta["generation"],
+            n + "_mining_features" : data[n].columns["ore2"].start,
+            n + "_mining_settings" : get_hash(get_settings(cfg, n)),
+            n + "_mining_updates" : cfg.model_data.get(n + "_mining_updates", 0) + 1 if grown[n] else 0
+        })
+        cfg.accuracy["mining"][n] = a
+    return accuracy
+
+# Predict every row of a 2-D feature matrix with a classifier, returning the labels and their confidence
+def predict_classifier(classifier, features):
+    features = np.atleast_2d(features)
+    if isinstance(classifier, forest.CompiledForest):
+        return classifier.predict(features)
+    if hasattr(classifier, "classes_"):
+        # A forest trained on every output gives the probabilities of all of them at once
+        probabilities = classifier.predict_proba(features)
+        classes = classifier.classes_
+        if classifier.n_outputs_ == 1:
+            probabilities, classes = [probabilities], [classes]
+    else:
+        # Run each output's forest once
+        probabilities = [estimator.predict_proba(features) for estimator in classifier.estimators_]
+        classes = [estimator.classes_ for estimator in classifier.estimators_]
+    # The predicted label is the most probable class
+    labels = np.stack([c[np.argmax(p, axis=1)] for c, p in zip(classes, probabilities)], axis=1)
+    confidence = np.stack([np.max(p, axis=1) for p in probabilities], axis=1)
+    return labels, confidence
+
+# Get the amount of features a classifier takes
+def get_n_features(classifier) -> int:
+    return classifier.n_features if isinstance(classifier, forest.CompiledForest) else classifier.n_features_in_
+
+# Build the feature vector the mining models take, with the shown ores in order and padded with -1 to the amount given like the stored rows
+def mining_features(date, ore_shown, leylines, shown) -> list:
+    if len(ore_shown) > shown:
+        raise ValueError(f"{ len(ore_shown) } shown ores given, the model takes at most { shown }")
+    return list(date) + sorted(ore_shown) + [-1] * (shown - len(ore_shown)) + list(leylines)
+
+# Predict a list of (nation, date, shown ores, leylines) records, calling each nation's model once
+def predict_records(models, records):
+    labels = [None] * len(records)
+    confidence = [None] * len(records)
+    # Group the records by nation
+    groups = {}
+    for i, record in enumerate(records):
+        groups.setdefault(record[0], []).append(i)
+    for nation, indices in groups.items():
+        features = np.array([models[nation].get_features(*records[i][1:]) for i in indices])
+        nation_labels, nation_confidence = models[nation].predict_batch(features)
+        # Put the results back in the order of the records
+        for j, i in enumerate(indices):
+            labels[i] = nation_labels[j]
+            confidence[i] = nation_confidence[j]
+    return labels, confidence
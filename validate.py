@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import logging as log
+
+from os.path import isfile
+
+import dataset
+
+# Most rows listed in the report per check
+listed_rows = 10
+
+# Check that the data file holds exactly the rows its metadata file gives
+# The metadata file is read as is, as a store whose size does not match is read as having no rows
+def check_file(data: dataset.MiningDataset) -> dict:
+    if not isfile(data.meta_file):
+        return {}
+    with open(data.meta_file) as f:
+        meta = json.load(f)
+    size = os.path.getsize(data.data_file) if isfile(data.data_file) else 0
+    if meta["version"] != dataset.MiningDataset.version or size == meta["rows"] * dataset.MiningDataset.get_width(meta) * dataset.MiningDataset.dtype.itemsize:
+        return {}
+    return { "file_size_mismatch" : np.arange(meta["rows"]) }
+
+# Check a nation's stored data, returning the rows that fail each check
+def check_nation(data: dataset.MiningDataset) -> dict:
+    problems = check_file(data)
+    if data.rows == 0:
+        return problems
+    meta = data.meta
+    matrix = np.asarray(data.load())
+    columns = data.columns
+
+    # The data file has to match the hash of its metadata
+    if data.get_hash() != meta["hash"]:
+        problems["file_mismatch"] = np.arange(data.rows)
+
+    # Dates have to exist, and be stored once each and in order
+    d = matrix[:, columns["date"]].astype(np.int64)
+    days = (d[:, 0] - 1970).astype("datetime64[Y]").astype("datetime64[M]") + (d[:, 1] - 1)
+    days = days.astype("datetime64[D]") + (d[:, 2] - 1)
+    months = days.astype("datetime64[M]").astype(np.int64) % 12 + 1
+    problems["invalid_dates"] = np.flatnonzero((d[:, 1] < 1) | (d[:, 1] > 12) | (d[:, 2] < 1) | (months != d[:, 1]))
+    # Every row but the first of a date is a duplicate
+    _, first = np.unique(days, return_index=True)
+    problems["duplicate_dates"] = np.setdiff1d(np.arange(data.rows), first)
+    gaps = np.diff(days).astype(np.int64)
+    problems["unordered_dates"] = np.flatnonzero(gaps < 0) + 1
+    # Days without a row are listed as the row after the gap
+    problems["missing_dates"] = np.flatnonzero(gaps > 1) + 1
+
+    # Ore indices have to point at an ore, and match the masks they were made from
+    ore1, ore2 = matrix[:, columns["ore1"]], matrix[:, columns["ore2"]]
+    shown, hidden = matrix[:, columns["ore1_mask"]], matrix[:, columns["ore2_mask"]]
+    problems["ore_out_of_range"] = np.flatnonzero(((ore1 < -1) | (ore1 >= meta["ores"])).any(axis=1) | ((ore2 < -1) | (ore2 >= meta["ores"])).any(axis=1))
+    problems["misaligned_ores"] = np.flatnonzero(
+        (~np.isin(shown, [0, 1])).any(axis=1) | (~np.isin(hidden, [0, 1])).any(axis=1) |
+        (ore1 != dataset.MiningDataset.get_indices(shown == 1, meta["shown"])).any(axis=1) |
+        (ore2 != dataset.MiningDataset.get_indices(hidden == 1, meta["hidden"])).any(axis=1))
+    problems["overlapping_ores"] = np.flatnonzero(((shown == 1) & (hidden == 1)).any(axis=1))
+
+    # Both leylines have to be found, in different places
+    y, b = matrix[:, columns["y"]], matrix[:, columns["b"]]
+    problems["invalid_leylines"] = np.flatnonzero((y < 0) | (b < 0))
+    problems["same_leylines"] = np.flatnonzero(y == b)
+
+    # Rows the model learns little from, with fewer ores than most rows or hidden ores that almost never come up
+    shown_count, hidden_count = (shown == 1).sum(axis=1), (hidden == 1).sum(axis=1)
+    problems["unusual_ore_count"] = np.flatnonzero((shown_count != np.bincount(shown_count).argmax()) | (hidden_count != np.bincount(hidden_count).argmax()))
+    rare = np.zeros(data.rows, dtype=bool)
+    for k in range(ore2.shape[1]):
+        _, inverse, counts = np.unique(ore2[:, k], return_inverse=True, return_counts=True)
+        rare |= counts[inverse.reshape(-1)] == 1
+    problems["rare_hidden_ores"] = np.flatnonzero(rare)
+
+    return { name : rows for name, rows in problems.items() if len(rows) }
+
+# Check the stored data of every nation
+def check_all(data_prefix, nations) -> dict:
+    return { n : check_nation(dataset.MiningDataset(data_prefix, n)) for n in nations }
+
+# Turn the checked rows into a report, listing the first rows of each check with their dates, rows that could not be read are only counted
+def get_report(data_prefix, results) -> dict:
+    report = {}
+    for n, problems in results.items():
+        data = dataset.MiningDataset(data_prefix, n)
+        d = np.asarray(data.column("date")) if data.rows else np.zeros((0, 3), dtype=int)
+        report[n] = { "rows" : data.rows, "problems" : {
+            name : { "count" : len(rows), "rows" : [{ "row" : int(r), "date" : "{}-{:02}-{:02}".format(*d[r]) } for r in rows[:listed_rows] if r < len(d)] }
+            for name, rows in problems.items()
+        }}
+    return report
+
+# Check the stored data and log what was found, returning the report
+def run(cfg) -> dict:
+    start = time.perf_counter()
+    results = check_all(cfg.data_prefix, cfg.nations)
+    seconds = time.perf_counter() - start
+    report = get_report(cfg.data_prefix, results)
+    for n, nation in report.items():
+        if not nation["problems"]:
+            cfg.write_log(f"Validate: [{ n }] { nation['rows'] } rows, no problems found", log.info)
+        for name, problem in nation["problems"].items():
+            rows = ", ".join(f"{ r['row'] } ({ r['date'] })" for r in problem["rows"])
+            more = f" and { problem['count'] - len(problem['rows']) } more" if problem["count"] > len(problem["rows"]) else ""
+            listed = f": { rows }{ more }" if problem["rows"] else ""
+            cfg.write_log(f"Validate: [{ n }] { problem['count'] } rows with { name.replace('_', ' ') }{ listed }", log.warning, True)
+    cfg.write_log(f"Validate: Checked { sum(r['rows'] for r in report.values()) } rows of { len(report) } nations in { seconds:.3f}s", log.info, True)
+    return report
+
+# Check the stored data without connecting to the sheet, writing the report as JSON
+def main():
+    parser = argparse.ArgumentParser(prog="Leyline Classifier Validator", description="Checks the stored data of every nation for errors")
+    parser.add_argument('-o', '--output', dest="output", default=None, help="what file the report is written to, printed if not given", type=str)
+    arg = parser.parse_args()
+
+    with open("config.json") as config:
+        data = json.load(config)
+    start = time.perf_counter()
+    results = check_all(data["data_prefix"], data["nations"])
+    print(f"Validate: Checked { len(results) } nations in { time.perf_counter() - start:.3f}s", file=sys.stderr)
+    report = json.dumps(get_report(data["data_prefix"], results), indent=2)
+    if arg.output is None:
+        print(report)
+        return
+    with open(arg.output, 'w') as f:
+        f.write(report)
+
+if __name__ == "__main__":
+    sys.exit(main())